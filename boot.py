@@ -0,0 +1,51 @@
+import usb_hid
+import usb_cdc
+import config
+
+# N-key rollover keyboard: 1 byte modifiers and 1 bit for every keycode 0x00-0x77.
+# Report id 4 so it won't clash with mouse (2) and consumer control (3).
+NKRO_KEYBOARD_DESCRIPTOR = bytes(
+    (
+        0x05, 0x01,  # Usage Page (Generic Desktop)
+        0x09, 0x06,  # Usage (Keyboard)
+        0xA1, 0x01,  # Collection (Application)
+        0x85, 0x04,  #   Report ID (4)
+        0x05, 0x07,  #   Usage Page (Keyboard)
+        0x19, 0xE0,  #   Usage Minimum (Left Control)
+        0x29, 0xE7,  #   Usage Maximum (Right GUI)
+        0x15, 0x00,  #   Logical Minimum (0)
+        0x25, 0x01,  #   Logical Maximum (1)
+        0x75, 0x01,  #   Report Size (1)
+        0x95, 0x08,  #   Report Count (8)
+        0x81, 0x02,  #   Input (Data, Variable, Absolute), modifiers
+        0x19, 0x00,  #   Usage Minimum (0)
+        0x29, 0x77,  #   Usage Maximum (0x77)
+        0x95, 0x78,  #   Report Count (120)
+        0x81, 0x02,  #   Input (Data, Variable, Absolute), key bitmap
+        0x05, 0x08,  #   Usage Page (LEDs)
+        0x19, 0x01,  #   Usage Minimum (Num Lock)
+        0x29, 0x05,  #   Usage Maximum (Kana)
+        0x95, 0x05,  #   Report Count (5)
+        0x91, 0x02,  #   Output (Data, Variable, Absolute), LED report
+        0x95, 0x01,  #   Report Count (1)
+        0x75, 0x03,  #   Report Size (3)
+        0x91, 0x01,  #   Output (Constant), LED report padding
+        0xC0,  # End Collection
+    )
+)
+
+if config.USE_NKRO:
+    nkro_keyboard = usb_hid.Device(
+        report_descriptor=NKRO_KEYBOARD_DESCRIPTOR,
+        usage_page=0x01,
+        usage=0x06,
+        report_ids=(4,),
+        in_report_lengths=(16,),  # same as hid_report.NKRO_REPORT_LENGTH
+        out_report_lengths=(1,),
+    )
+    usb_hid.enable(
+        (nkro_keyboard, usb_hid.Device.MOUSE, usb_hid.Device.CONSUMER_CONTROL)
+    )
+
+# Second serial port for deej, so volumes don't go through the REPL console
+usb_cdc.enable(console=True, data=config.USE_DEEJ)
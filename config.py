@@ -3,9 +3,29 @@ import board
 IO_EXPANDER_PINS = {"SDA": board.GP12, "SCL": board.GP13}
 MATRIX_IO_EXPANDER_ADDRESS = 0x25
 BUTTON_IO_EXPANDER_ADDRESS = 0x20
+# I2C clock of the expanders. PCF8574 is rated for 100 kHz but most of them work at
+# fast-mode 400 kHz, at start every expander is probed and the bus fall back to
+# I2C_FALLBACK_FREQUENCY when it doesn't answer correctly.
+I2C_FREQUENCY = 400_000
+I2C_FALLBACK_FREQUENCY = 100_000
+# GPIO wired to PCF8574 INT pin, set None if INT is not wired and the expander will be polled
+MATRIX_INTERUPT_PIN = None  # e.g. board.GP16
+BUTTON_INTERUPT_PIN = None  # e.g. board.GP25
 DEEJ_PROGRAMS = ["Master", "Firefox", "Spotify", "Discord", "Apex"]
 
 USE_DEEJ = False
+# Volumes are sent on the second USB serial port (usb_cdc.data, enabled in boot.py) at
+# most once per "deej" task period and only when changed. Binary framing need a host
+# program that read it, the deej desktop app need text.
+DEEJ_BINARY = False
+# Volumes and current program are saved in microcontroller.nvm (start, length), None to
+# disable. Saved once after nothing changed for DEEJ_SAVE_DELAY seconds, and every save
+# go to the next record of the range so the same bytes aren't written every time.
+DEEJ_NVM_RANGE = (0, 1024)
+DEEJ_SAVE_DELAY = 10
+# N-key rollover keyboard, it also need to be enabled in boot.py (need reset after change).
+# Without it only 6 keys are sent at once and the others wait until a key is released.
+USE_NKRO = False
 DISPLAY_PINS = {
     "CLOCK": board.GP18,
     "MOSI": board.GP19,
@@ -15,9 +35,67 @@ DISPLAY_PINS = {
     "BL": board.GP23,
     "ROTATION": 180,
 }
+# Display is refreshed at most DISPLAY_MAX_FPS times per second, and never more than
+# DISPLAY_DUTY of the time, so slow SPI refresh won't delay the input tasks.
+DISPLAY_MAX_FPS = 20
+DISPLAY_DUTY = 0.25
+# Seconds each image of the slideshow is shown, and how many images are kept open
+SLIDESHOW_DWELL = 60
+SLIDESHOW_CACHE = 2
+# GIF played on the screen, None to disable. Frames are decoded once into RAM when they
+# fit, else put "name.gfp" frame pack (see lib/display.py) next to it so frames don't
+# have to be decoded on the Pico while playing.
+GIF_FILE = None  # e.g. "/media/mon.gif"
 
 MATRIX_ROW_PINS = [board.GP14, board.GP15, board.GP17, board.GP24]
 MATRIX_COL_PINS = [0, 1, 2, 3, 4]
+# Time in seconds a matrix row is driven before its columns are read. None mean read
+# it on the next "matrix" task tick, so full scan take one tick per row without blocking.
+MATRIX_ROW_SETTLE = None
+
+# Debounce algorithm for matrix and encoder buttons: "eager", "deferred", "integrator" or None.
+# eager: press/release sent right away then the key is ignored for DEBOUNCE_TIME.
+# deferred: press/release sent after the key stayed the same for DEBOUNCE_TIME.
+# integrator: press/release sent after DEBOUNCE_SAMPLES scans that agree, keep samples * scan
+#   period shorter than a quick tap.
+DEBOUNCE = "eager"
+DEBOUNCE_TIME = 0.005  # seconds
+DEBOUNCE_SAMPLES = 4
+MATRIX_DEBOUNCE_KEYS = {}  # debounce time for noisy switch, {(row, col): seconds}
+
+# Scanning tasks queue timestamped input events and the "dispatch" task run their actions,
+# so a slow action doesn't stall scanning. When the queue is full the change is found
+# again on the next scan.
+EVENT_QUEUE_SIZE = 64
+
+# Scheduler tasks, "name": (period in seconds, rounded to whole milliseconds, priority).
+# Lower priority number is more important and will never wait behind less important task.
+TASKS = {
+    "dispatch": (0.001, 0),
+    "hid": (0.001, 0),
+    "encoders": (0.002, 0),
+    "buttons": (0.01, 1),
+    "matrix": (0.003, 1),
+    "deej": (0.05, 2),
+    "display": (0.01, 3),
+    "gif": (0.01, 3),
+    "slideshow": (0.5, 3),
+    "macro": (0.005, 1),  # period is the delay between macro reports
+    "profile": (0.25, 4),
+    "gc": (0.1, 4),
+}
+# Time every task in histograms, print them every PROFILE_DUMP seconds (None to only
+# print them when "p" is sent on the console, "r" reset them). Disabled cost nothing.
+PROFILE = False
+PROFILE_DUMP = None
+# gc.collect() is run only when no input is active, when free RAM is below GC_LOW_WATER
+# bytes or GC_MAX_INTERVAL seconds passed, so collection won't pause a key press.
+GC_LOW_WATER = 32_000
+GC_MAX_INTERVAL = 5
+# Check the input tasks (hid, encoders, buttons, matrix) don't allocate: None, "log"
+# to print them or "assert" to stop with an error. For testing on the board (it need
+# gc.mem_alloc, the simulator doesn't have it), it slow down the tasks.
+ALLOC_CHECK = None
 
 ROTARY_ENCODERS_NUM = 6
 ROTARY_ENCODERS_PHYSICAL_ORDER = [1, 6, 4, 2, 5, 3]
@@ -33,52 +111,80 @@ without changing the wiring.
 """
 
 
-def input_map(screen, deej, BiT, key, hid, cc_code):
+# Binary keymap made by keymap-compiler/compile_keymap.py, None use input_map() below.
+# Only the layer named KEYMAP_LAYER is read from it.
+KEYMAP_FILE = None  # e.g. "/keymap.bin"
+KEYMAP_LAYER = "base"
+
+
+def functions(screen, deej, hid):
+    """Functions the binary keymap call by name ("fn:name"). Encoder turn functions
+    get number of detents, button functions get no argument."""
+    return {
+        "brightness_down": lambda n: screen.change_brightness(-n),
+        "brightness_up": lambda n: screen.change_brightness(+n),
+        "volume_down": lambda n: deej.change_volume(-5 * n),
+        "volume_up": lambda n: deej.change_volume(+5 * n),
+        "deej_previous": lambda: deej.cycle_programs(-1),
+        "deej_next": lambda: deej.cycle_programs(+1),
+        "cancel_macro": hid.MACRO.cancel,
+    }
+
+
+def input_map(screen, deej, BiT, key, hid, cc_code, repeat):
+    """Encoder actions are called with number of detents the knob moved.
+    Wrap single step action with repeat() to run it once for every detent.
+    Optional "acceleration" is ((detents per second, multiplier), ...),
+    so fast spin move further.
+    BiT.MACRO type text, or a sequence of keys, chords, text and pauses in seconds,
+    a report at a time while scanning go on. hid.MACRO.cancel() stop it.
+    """
     ENCODERS = [
         {  # Encoder 1
             "actions": (
-                # lambda: SCREEN.change_brightness(-1),
-                # lambda: SCREEN.change_brightness(+1),
-                lambda: hid.KBD.send(key.CONTROL, key.Z),
-                lambda: hid.KBD.send(key.CONTROL, key.SHIFT, key.Z),
+                # lambda n: screen.change_brightness(-n),
+                # lambda n: screen.change_brightness(+n),
+                repeat(lambda: hid.REPORT.send(key.CONTROL, key.Z)),
+                repeat(lambda: hid.REPORT.send(key.CONTROL, key.SHIFT, key.Z)),
             ),
             "button": {"pin": 1, "actions": (BiT.KEY, [key.ONE])},
         },
         {  # Encoder 2
             "actions": (
-                # lambda: DEEJ.change_volume(-5),
-                # lambda: DEEJ.change_volume(+5),
-                lambda: SCREEN.change_brightness(-1),
-                lambda: SCREEN.change_brightness(+1),
+                # lambda n: deej.change_volume(-5 * n),
+                # lambda n: deej.change_volume(+5 * n),
+                lambda n: screen.change_brightness(-n),
+                lambda n: screen.change_brightness(+n),
             ),
             "button": {"pin": 0, "actions": (BiT.KEY, [key.TWO])},
         },
         {  # Encoder 3
             "actions": (
-                lambda: hid.MOUSE.move(wheel=-1),
-                lambda: hid.MOUSE.move(wheel=1),
+                lambda n: hid.REPORT.move(wheel=-n),
+                lambda n: hid.REPORT.move(wheel=n),
             ),
+            "acceleration": ((10, 2), (25, 4)),
             "button": {"pin": 3, "actions": (BiT.KEY, [key.TWO])},
         },
         {  # Encoder 4
             "actions": (
-                lambda: hid.KBD.send(key.CONTROL, key.LEFT_BRACKET),
-                lambda: hid.KBD.send(key.CONTROL, key.RIGHT_BRACKET),
+                repeat(lambda: hid.REPORT.send(key.CONTROL, key.LEFT_BRACKET)),
+                repeat(lambda: hid.REPORT.send(key.CONTROL, key.RIGHT_BRACKET)),
             ),
             "button": {"pin": 2, "actions": (BiT.KEY, [key.FIVE])},
         },
         {  # Encoder 5
             "actions": (
-                lambda: hid.KBD.send(key.CONTROL, key.Z),
-                lambda: hid.KBD.send(key.CONTROL, key.SHIFT, key.Z),
+                repeat(lambda: hid.REPORT.send(key.CONTROL, key.Z)),
+                repeat(lambda: hid.REPORT.send(key.CONTROL, key.SHIFT, key.Z)),
             ),
             "button": {"pin": 4, "actions": (BiT.KEY, [key.FIVE])},
         },
         {  # Encoder 6
             "actions": (
-                lambda: hid.KBD.send(key.CONTROL, key.ALT, key.ONE),
-                lambda: hid.KBD.send(key.CONTROL, key.ALT, key.TWO),
-                lambda: hid.KBD.send(key.CONTROL, key.ALT, key.THREE),
+                lambda n: hid.REPORT.send(key.CONTROL, key.ALT, key.ONE),
+                lambda n: hid.REPORT.send(key.CONTROL, key.ALT, key.TWO),
+                lambda n: hid.REPORT.send(key.CONTROL, key.ALT, key.THREE),
             ),
             "button": {"pin": 5, "actions": (BiT.KEY, [key.FORWARD_SLASH])},
         },
@@ -86,11 +192,11 @@ def input_map(screen, deej, BiT, key, hid, cc_code):
 
     KEYPADS = [
         [  # Row 1
-            (BiT.CUSTOM, lambda: DEEJ.cycle_programs(-1)),
+            (BiT.CUSTOM, lambda: deej.cycle_programs(-1)),
             (BiT.MEDIA, cc_code.SCAN_PREVIOUS_TRACK),
             (BiT.MEDIA, cc_code.PLAY_PAUSE),
             (BiT.MEDIA, cc_code.SCAN_NEXT_TRACK),
-            (BiT.CUSTOM, lambda: DEEJ.cycle_programs(+1)),
+            (BiT.CUSTOM, lambda: deej.cycle_programs(+1)),
         ],
         [  # Row 2
             (BiT.KEY, [key.INSERT]),
@@ -109,6 +215,10 @@ def input_map(screen, deej, BiT, key, hid, cc_code):
         [  # Row 4
             (BiT.KEY, [key.SHIFT]),
             (BiT.KEY, [key.CONTROL]),
+            # Macros in place of R, S and T:
+            # (BiT.MACRO, "Hello world\n"),
+            # (BiT.MACRO, ([key.CONTROL, key.L], 0.2, "github.com\n")),
+            # (BiT.CUSTOM, hid.MACRO.cancel),
             (BiT.KEY, [key.R]),
             (BiT.KEY, [key.S]),
             (BiT.KEY, [key.T]),
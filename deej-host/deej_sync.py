@@ -0,0 +1,304 @@
+"""Keep the macropad deej volumes and the host audio sessions in sync.
+
+The macropad send its volumes on usb_cdc.data (binary frames with
+DEEJ_BINARY = True, or deej text lines), this program set them on the audio
+sessions. Volumes and session names changed on the host are sent back, so the
+macropad screen show the real volumes and programs instead of DEEJ_PROGRAMS:
+
+    0xDF, op, program index, length, payload * length, checksum
+
+op is VOLUME (payload u8 volume 0-100), NAME (utf-8 name, empty when the
+session is gone) or SYNC (ask the macropad to send all its volumes). Program 0
+is always the master volume, the other sessions take the free programs in the
+order they appear.
+
+Usage:
+
+    pip install pyserial pulsectl
+    python deej_sync.py /dev/ttyACM1            # PulseAudio / PipeWire
+    python deej_sync.py /dev/ttyACM1 --fake     # fake sessions, no audio change
+    python deej_sync.py --selftest              # fake sessions and lib/deej.py
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+BINARY_FRAME_START = 0xDE  # same as lib/deej.py
+HOST_FRAME_START = 0xDF
+MAX_NAME_LENGTH = 15
+MAX_ANALOG_VOLUME = 1023
+VOLUME, NAME, SYNC = 1, 2, 3  # same as deej.HostOp
+MASTER = "Master"
+
+
+def host_frame(op: int, index: int, payload: bytes = b"") -> bytes:
+    frame = bytes([HOST_FRAME_START, op, index, len(payload)]) + payload
+    return frame + bytes([sum(frame) & 0xFF])
+
+
+def name_payload(name: str) -> bytes:
+    """Name cut to MAX_NAME_LENGTH bytes without splitting a UTF-8 character"""
+    return name.encode()[:MAX_NAME_LENGTH].decode("utf-8", "ignore").encode()
+
+
+def digital_volume(analog: int) -> int:
+    return round(analog * 100 / MAX_ANALOG_VOLUME)
+
+
+class DeviceReader:
+    """Split bytes from the macropad into volume lists (0-100), binary or text"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes) -> list:
+        self.buffer += data
+        frames = []
+        while self.buffer:
+            if self.buffer[0] == BINARY_FRAME_START:
+                if len(self.buffer) < 2:
+                    break
+                size = 3 + self.buffer[1] * 2
+                if len(self.buffer) < size:
+                    break
+                frame = self.buffer[:size]
+                del self.buffer[:size]
+                if sum(frame[:-1]) & 0xFF != frame[-1]:
+                    continue
+                frames.append(
+                    [
+                        digital_volume(frame[2 + i * 2] | (frame[3 + i * 2] << 8))
+                        for i in range(frame[1])
+                    ]
+                )
+            else:
+                end = self.buffer.find(b"\n")
+                if end < 0:
+                    break
+                line = self.buffer[:end].strip()
+                del self.buffer[: end + 1]
+                try:
+                    frames.append([digital_volume(int(v)) for v in line.split(b"|")])
+                except ValueError:
+                    pass  # console text or a broken line
+        return frames
+
+
+class FakeBackend:
+    """Audio sessions in memory, with --fake they also change on their own"""
+
+    def __init__(self, wander: bool = False):
+        self.volumes = {MASTER: 70, "Firefox": 100, "Spotify": 40}
+        self.wander = wander
+        self.waiting = ["Discord", "Apex"]
+
+    def sessions(self) -> dict:
+        if self.wander and random.random() < 0.05:
+            name = random.choice(list(self.volumes))
+            self.volumes[name] = random.randrange(0, 101, 5)
+        if self.wander and random.random() < 0.01:
+            if self.waiting:
+                self.volumes[self.waiting.pop()] = 100
+            elif len(self.volumes) > 1:
+                name = random.choice([n for n in self.volumes if n != MASTER])
+                self.waiting.append(name)
+                del self.volumes[name]
+        return dict(self.volumes)
+
+    def set_volume(self, name: str, volume: int):
+        if name in self.volumes:
+            self.volumes[name] = volume
+
+
+class PulseBackend:
+    """Default sink is the master, every application stream is a session"""
+
+    def __init__(self):
+        import pulsectl
+
+        self.pulse = pulsectl.Pulse("macropad-deej")
+
+    def streams(self) -> dict:
+        default_sink = self.pulse.server_info().default_sink_name
+        streams = {MASTER: self.pulse.get_sink_by_name(default_sink)}
+        for stream in self.pulse.sink_input_list():
+            name = stream.proplist.get("application.name", f"#{stream.index}")
+            streams.setdefault(name, stream)
+        return streams
+
+    def sessions(self) -> dict:
+        return {
+            name: min(100, round(self.pulse.volume_get_all_chans(stream) * 100))
+            for name, stream in self.streams().items()
+        }
+
+    def set_volume(self, name: str, volume: int):
+        stream = self.streams().get(name)
+        if stream is not None:
+            self.pulse.volume_set_all_chans(stream, volume / 100)
+
+
+class Sync:
+    def __init__(self, serial, backend, programs: int):
+        self.serial = serial
+        self.backend = backend
+        self.slots = [None] * programs  # session name of every macropad program
+        self.known = [None] * programs  # last volume both side agree on
+        self.reader = DeviceReader()
+
+    def assign(self, sessions: dict):
+        """Give new sessions a free program, free the programs of gone sessions"""
+        for index, name in enumerate(self.slots):
+            if name is not None and name not in sessions:
+                self.slots[index] = None
+                self.known[index] = None
+                self.serial.write(host_frame(NAME, index))
+        for name in sessions:
+            if name in self.slots:
+                continue
+            if name == MASTER:
+                index = 0
+            elif None in self.slots[1:]:
+                index = self.slots.index(None, 1)
+            else:
+                continue  # more sessions than macropad programs
+            self.slots[index] = name
+            self.serial.write(host_frame(NAME, index, name_payload(name)))
+
+    def host_changes(self):
+        """Send the volumes changed on the host"""
+        sessions = self.backend.sessions()
+        self.assign(sessions)
+        for index, name in enumerate(self.slots):
+            if name is not None and sessions[name] != self.known[index]:
+                self.known[index] = sessions[name]
+                self.serial.write(host_frame(VOLUME, index, bytes([sessions[name]])))
+
+    def device_changes(self):
+        """Apply the volumes changed on the macropad"""
+        waiting = self.serial.in_waiting
+        if not waiting:
+            return
+        for volumes in self.reader.feed(self.serial.read(waiting)):
+            for index, volume in enumerate(volumes[: len(self.slots)]):
+                name = self.slots[index]
+                if name is not None and volume != self.known[index]:
+                    self.known[index] = volume
+                    self.backend.set_volume(name, volume)
+
+    def start(self):
+        self.serial.reset_input_buffer()  # volumes sent before the host state is known
+        self.host_changes()
+        self.serial.write(host_frame(SYNC, 0))
+
+    def run(self, poll: float):
+        self.start()
+        while True:
+            self.device_changes()
+            self.host_changes()
+            time.sleep(poll)
+
+
+class Loopback:
+    """One end of an in-memory serial pair"""
+
+    def __init__(self):
+        self.incoming = bytearray()
+        self.other = None
+        self.connected = True
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.incoming)
+
+    def read(self, size: int = 1) -> bytes:
+        data = bytes(self.incoming[:size])
+        del self.incoming[:size]
+        return data
+
+    def readinto(self, buf) -> int:
+        data = self.read(len(buf))
+        buf[: len(data)] = data
+        return len(data)
+
+    def write(self, data) -> int:
+        self.other.incoming += data
+        return len(data)
+
+    def reset_input_buffer(self):
+        self.incoming.clear()
+
+
+def selftest():
+    """Run lib/deej.py against the fake backend over a loopback serial"""
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
+    from deej import Deej
+
+    device, host = Loopback(), Loopback()
+    device.other, host.other = host, device
+    deej = Deej(["Master", "Firefox", "Spotify", "Discord", "Apex"], serial=device, binary=True)
+    backend = FakeBackend()
+    sync = Sync(host, backend, deej.num_programs)
+
+    def step():
+        sync.host_changes()
+        deej.poll()
+        deej.flush()
+        sync.device_changes()
+
+    sync.start()
+    deej.poll()
+    assert deej.volumes[:3] == [70, 100, 40], deej.volumes
+    assert deej.programs[:3] == ["Master", "Firefox", "Spotify"], deej.programs
+
+    backend.volumes["Spotify"] = 15  # changed on the host
+    step()
+    assert deej.volumes[2] == 15 and deej.updated[2], deej.volumes
+
+    deej.current_program_index = 1  # changed on the macropad
+    deej.change_volume(-30)
+    step()
+    assert backend.volumes["Firefox"] == 70, backend.volumes
+
+    del backend.volumes["Spotify"]  # session closed
+    backend.volumes["Discord"] = 55
+    step()
+    assert deej.programs[2] == "Discord" and deej.volumes[2] == 55, deej.programs
+
+    backend.volumes["Café Müller ÄÄÄ"] = 30  # cut inside Ä without name_payload
+    step()
+    assert deej.programs[3] == "Café Müller ", deej.programs
+
+    host.write(host_frame(NAME, 4, "Ä".encode()[:1]))  # broken UTF-8 is dropped
+    deej.poll()
+    assert deej.programs[4] == "Apex", deej.programs
+    print("selftest ok")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("port", nargs="?", help="macropad data serial port")
+    parser.add_argument("--programs", type=int, default=5, help="len(DEEJ_PROGRAMS)")
+    parser.add_argument("--poll", type=float, default=0.1, help="seconds between checks")
+    parser.add_argument("--fake", action="store_true", help="fake audio sessions")
+    parser.add_argument("--selftest", action="store_true")
+    args = parser.parse_args()
+
+    if args.selftest:
+        selftest()
+        return
+    if args.port is None:
+        parser.error("port is required")
+
+    import serial
+
+    backend = FakeBackend(wander=True) if args.fake else PulseBackend()
+    with serial.Serial(args.port, timeout=0) as port:
+        Sync(port, backend, args.programs).run(args.poll)
+
+
+if __name__ == "__main__":
+    main()
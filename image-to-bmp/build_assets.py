@@ -0,0 +1,260 @@
+"""Convert a whole media folder to the formats the macropad load the fastest.
+
+- Images (.jpg, .png, .bmp) become 240x240 BMP for Slideshow, as palette BMP
+  (default) or RGB565 BMP (--rgb565). Rows are bottom-up and padded to 4
+  bytes like displayio.OnDiskBitmap expects.
+- Images in the Icons folder keep their size and become palette BMP where
+  index 0 is the transparent background (DisplayScreen.show_icons).
+- GIFs are copied and get a .gfp frame pack next to them: every frame already
+  composited and stored as raw RGB565, read by PlayGif with no decoding.
+
+slideshow.txt list the slideshow images so the Pico doesn't have to list the
+folder at boot. Files are converted in parallel on every CPU core. Hash of the
+source file and the options is kept in the output folder, unchanged files are
+skipped when all their outputs (for a GIF also the .gfp pack) exist.
+
+Usage:
+
+    pip install pillow
+    python build_assets.py path/to/media path/to/CIRCUITPY/media
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import struct
+from multiprocessing import Pool
+
+from PIL import Image, ImageSequence
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+ICONS_FOLDER = "Icons"
+CACHE_FILE = ".asset-cache.json"
+SLIDESHOW_MANIFEST = "slideshow.txt"  # same as lib/display.py
+GIF_PACK_MAGIC = b"GFP1"  # same as lib/display.py
+GIF_PACK_HEADER = "<4sHHH"  # magic, width, height, frame count
+
+
+def rgb565(image: Image.Image, big_endian: bool) -> bytearray:
+    """Pack RGB image to 16 bit pixels, row by row from the top"""
+    data = image.convert("RGB").tobytes()
+    out = bytearray(len(data) // 3 * 2)
+    j = 0
+    for i in range(0, len(data), 3):
+        value = ((data[i] & 0xF8) << 8) | ((data[i + 1] & 0xFC) << 3) | (data[i + 2] >> 3)
+        if big_endian:
+            out[j] = value >> 8
+            out[j + 1] = value & 0xFF
+        else:
+            out[j] = value & 0xFF
+            out[j + 1] = value >> 8
+        j += 2
+    return out
+
+
+def bmp_header(width: int, height: int, bits: int, extra: bytes, compression: int = 0):
+    """File header and BITMAPINFOHEADER, `extra` is the palette or the bit masks"""
+    row_size = (width * bits + 31) // 32 * 4
+    offset = 14 + 40 + len(extra)
+    size = offset + row_size * height
+    colors = len(extra) // 4 if bits <= 8 else 0
+    header = struct.pack("<2sIHHI", b"BM", size, 0, 0, offset)
+    header += struct.pack(
+        "<IiiHHIIiiII", 40, width, height, 1, bits, compression, row_size * height,
+        2835, 2835, colors, 0,
+    )
+    return header + extra, row_size
+
+
+def write_rgb565_bmp(path: str, image: Image.Image):
+    width, height = image.size
+    masks = struct.pack("<III", 0xF800, 0x07E0, 0x001F)
+    header, row_size = bmp_header(width, height, 16, masks, compression=3)  # BI_BITFIELDS
+    pixels = rgb565(image, big_endian=False)
+    padding = bytes(row_size - width * 2)
+    with open(path, "wb") as f:
+        f.write(header)
+        for y in range(height - 1, -1, -1):  # BMP rows are stored bottom-up
+            f.write(pixels[y * width * 2 : (y + 1) * width * 2])
+            f.write(padding)
+
+
+def write_palette_bmp(path: str, indices: bytes, size: tuple, palette: list):
+    """`indices` is one byte per pixel, `palette` is list of (r, g, b)"""
+    width, height = size
+    bits = 4 if len(palette) <= 16 else 8
+    extra = b"".join(struct.pack("<BBBB", b, g, r, 0) for r, g, b in palette)
+    header, row_size = bmp_header(width, height, bits, extra)
+    with open(path, "wb") as f:
+        f.write(header)
+        for y in range(height - 1, -1, -1):
+            row = indices[y * width : (y + 1) * width]
+            if bits == 4:
+                row = bytes(
+                    (row[x] << 4) | (row[x + 1] if x + 1 < width else 0)
+                    for x in range(0, width, 2)
+                )
+            f.write(row)
+            f.write(bytes(row_size - len(row)))
+
+
+def quantize(image: Image.Image, colors: int):
+    """Return (index per pixel, palette), palette only have the used colors"""
+    paletted = image.convert("RGB").quantize(colors=colors)
+    flat = paletted.getpalette()[: colors * 3]
+    palette = [tuple(flat[i : i + 3]) for i in range(0, len(flat), 3)]
+    return paletted.tobytes(), palette
+
+
+def convert_image(source: str, target: str, options: dict):
+    image = Image.open(source)
+    image = image.resize(options["size"])
+    if options["rgb565"]:
+        write_rgb565_bmp(target, image)
+    else:
+        indices, palette = quantize(image, options["colors"])
+        write_palette_bmp(target, indices, image.size, palette)
+
+
+def convert_icon(source: str, target: str, options: dict):
+    """Index 0 is kept for transparent pixels, show_icons make it transparent"""
+    image = Image.open(source).convert("RGBA")
+    indices, palette = quantize(image, options["colors"] - 1)
+    alpha = image.getchannel("A").tobytes()
+    indices = bytes(0 if a < 128 else i + 1 for i, a in zip(indices, alpha))
+    write_palette_bmp(target, indices, image.size, [(0, 0, 0)] + palette)
+
+
+def gif_pack_path(target: str) -> str:
+    return os.path.splitext(target)[0] + ".gfp"
+
+
+def outputs(kind: str, target: str) -> list:
+    """Every file written for one source, all of them must exist to skip it"""
+    if kind == "gif":
+        return [target, gif_pack_path(target)]
+    return [target]
+
+
+def convert_gif(source: str, target: str, options: dict):
+    """Copy the GIF and write frame pack with the same name and .gfp extension"""
+    shutil.copyfile(source, target)
+    gif = Image.open(source)
+    size = options["gif_size"] or gif.size
+    frames = []
+    delays = []
+    for frame in ImageSequence.Iterator(gif):
+        # Pillow compose every frame with the previous one following its disposal
+        frames.append(rgb565(frame.convert("RGB").resize(size), big_endian=True))
+        delays.append(min(0xFFFF, frame.info.get("duration", 100)))
+
+    with open(gif_pack_path(target), "wb") as f:
+        f.write(struct.pack(GIF_PACK_HEADER, GIF_PACK_MAGIC, size[0], size[1], len(frames)))
+        f.write(struct.pack(f"<{len(delays)}H", *delays))
+        for frame in frames:
+            f.write(frame)
+
+
+def find_assets(source_dir: str, target_dir: str):
+    """Yield (kind, source, target) for every file that can be converted"""
+    for folder, _, files in os.walk(source_dir):
+        relative = os.path.relpath(folder, source_dir)
+        is_icons = os.path.basename(folder) == ICONS_FOLDER
+        for name in sorted(files):
+            base, extension = os.path.splitext(name)
+            extension = extension.lower()
+            target = os.path.normpath(os.path.join(target_dir, relative, base))
+            if extension == ".gif":
+                yield "gif", os.path.join(folder, name), target + ".gif"
+            elif extension in IMAGE_EXTENSIONS:
+                kind = "icon" if is_icons else "image"
+                yield kind, os.path.join(folder, name), target + ".bmp"
+
+
+def file_hash(path: str, options: dict) -> str:
+    digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode())
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+CONVERTERS = {"image": convert_image, "icon": convert_icon, "gif": convert_gif}
+
+
+def build(job: tuple):
+    kind, source, target, options = job
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        CONVERTERS[kind](source, target, options)
+    except (OSError, ValueError) as e:
+        return source, str(e)
+    return source, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="folder with the original images and GIFs")
+    parser.add_argument("target", help="output folder, e.g. CIRCUITPY/media")
+    parser.add_argument("--size", type=int, nargs=2, default=(240, 240), help="image size")
+    parser.add_argument("--gif-size", type=int, nargs=2, help="GIF frame size, default keep")
+    parser.add_argument("--colors", type=int, default=64, help="palette size, max 256")
+    parser.add_argument("--rgb565", action="store_true", help="16 bit BMP instead of palette")
+    parser.add_argument("--jobs", type=int, help="worker processes, default every core")
+    parser.add_argument("--force", action="store_true", help="ignore the cache")
+    args = parser.parse_args()
+
+    options = {
+        "size": tuple(args.size),
+        "gif_size": tuple(args.gif_size) if args.gif_size else None,
+        "colors": min(256, args.colors),
+        "rgb565": args.rgb565,
+    }
+
+    cache_path = os.path.join(args.target, CACHE_FILE)
+    cache = {}
+    if not args.force and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+
+    jobs = []
+    hashes = {}
+    skipped = 0
+    for kind, source, target in find_assets(args.source, args.target):
+        key = os.path.relpath(target, args.target)
+        hashes[key] = file_hash(source, options)
+        if cache.get(key) == hashes[key] and all(map(os.path.exists, outputs(kind, target))):
+            skipped += 1
+            continue
+        jobs.append((kind, source, target, options))
+
+    failed = set()
+    with Pool(args.jobs) as pool:
+        for source, error in pool.imap_unordered(build, jobs):
+            if error:
+                failed.add(source)
+                print(f"FAILED {source}: {error}")
+            else:
+                print(f"built  {source}")
+
+    for kind, source, target, _ in jobs:
+        if source in failed:
+            hashes.pop(os.path.relpath(target, args.target))
+    os.makedirs(args.target, exist_ok=True)
+    with open(cache_path, "w") as f:
+        json.dump(hashes, f, indent=2, sort_keys=True)
+
+    # Slideshow read this list instead of listing the folder at boot
+    slides = sorted(
+        key for key in hashes if key.endswith(".bmp") and os.path.dirname(key) == ""
+    )
+    with open(os.path.join(args.target, SLIDESHOW_MANIFEST), "w") as f:
+        f.write("".join(name + "\n" for name in slides))
+
+    print(f"{len(jobs) - len(failed)} built, {skipped} unchanged, {len(failed)} failed")
+
+
+if __name__ == "__main__":
+    main()
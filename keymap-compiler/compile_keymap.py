@@ -0,0 +1,182 @@
+"""Compile readable keymap JSON into the binary keymap read by lib/keymap.py.
+
+Every layer has the key matrix actions (row by row) and the encoder actions,
+encoders are in the same order as ENCODERS in config.py. Actions are strings:
+
+    "CONTROL+SHIFT+Z"        keys pressed together (adafruit_hid Keycode names)
+    "media:PLAY_PAUSE"       consumer control (ConsumerControlCode names)
+    "fn:deej_next"           function from functions() in config.py, on encoder turn
+                             it's called with the number of detents, on a button
+                             with no argument, so one function can't be used for both
+    "wheel:-1"               mouse wheel step per detent, only for encoder turn
+    "layer:fn"               layer "fn" is on while the button is held
+    "toggle:fn"              turn layer "fn" on or off
+    "profile:games"          switch the base layer (profile) to "games"
+    null                     no action, in upper layers the lower layer action is used
+
+Usage:
+
+    pip install adafruit-circuitpython-hid
+    python compile_keymap.py keymap.json D:/keymap.bin   # D: is CIRCUITPY drive
+"""
+
+import argparse
+import json
+import struct
+import sys
+
+from adafruit_hid.keycode import Keycode
+from adafruit_hid.consumer_control_code import ConsumerControlCode
+
+# Same as lib/keymap.py
+KEYMAP_MAGIC = b"KMAP"
+KEYMAP_VERSION = 1
+KEYMAP_HEADER = "<4sBBBBBBH"
+LAYER_ENTRY = "<12sI"
+ENCODER_HEADER = "<BBBBBBxx"
+ACTION_RECORD = "<BB6s"
+NONE, MEDIA, KEY, CUSTOM, WHEEL, LAYER = range(6)
+LAYER_MODES = {"layer": 1, "toggle": 2, "profile": 3}  # same as layers.LayerMode
+MAX_KEYS = 6
+MAX_LAYER_NAME = 12  # bytes of the name in LAYER_ENTRY
+MAX_FUNCTION_NAME = 255  # name table store the length in one byte
+
+
+class KeymapError(ValueError):
+    pass
+
+
+def constant(names, name: str, what: str) -> int:
+    if name.isdigit():
+        return int(name)
+    if not hasattr(names, name):
+        raise KeymapError(f"unknown {what} {name}")
+    return getattr(names, name)
+
+
+def action_record(action, names: dict, layers: list, turn: bool = False) -> bytes:
+    """`names` is function name: True when it's used on encoder turn, in name table order"""
+    if action is None:
+        return struct.pack(ACTION_RECORD, NONE, 0, b"")
+
+    kind, _, value = action.rpartition(":")
+    if kind == "media":
+        code = constant(ConsumerControlCode, value, "consumer control code")
+        return struct.pack(ACTION_RECORD, MEDIA, 0, struct.pack("<H", code))
+    elif kind == "fn":
+        if value not in names:
+            if len(value.encode()) > MAX_FUNCTION_NAME:
+                raise KeymapError(f"function name {value} is over {MAX_FUNCTION_NAME} bytes")
+            names[value] = turn
+        elif names[value] != turn:
+            # Turn functions take the detent count, button functions no argument
+            raise KeymapError(f"{action} is used on both encoder turn and button")
+        index = list(names).index(value)
+        return struct.pack(ACTION_RECORD, CUSTOM, 0, struct.pack("<H", index))
+    elif kind == "wheel":
+        if not turn:
+            raise KeymapError(f"{action} only work on encoder turn")
+        return struct.pack(ACTION_RECORD, WHEEL, int(value) & 0xFF, b"")
+    elif kind in LAYER_MODES:
+        if turn:
+            raise KeymapError(f"{action} only work on buttons")
+        if value not in layers:
+            raise KeymapError(f"unknown layer {value} in {action}")
+        return struct.pack(ACTION_RECORD, LAYER, LAYER_MODES[kind], bytes([layers.index(value)]))
+    elif kind:
+        raise KeymapError(f"unknown action type {kind} in {action}")
+
+    keycodes = [constant(Keycode, name.strip(), "keycode") for name in value.split("+")]
+    if len(keycodes) > MAX_KEYS:
+        raise KeymapError(f"{action} has more than {MAX_KEYS} keys")
+    return struct.pack(ACTION_RECORD, KEY, len(keycodes), bytes(keycodes))
+
+
+def compile_layer(
+    layer: dict, rows: int, columns: int, slots: int, names: dict, layers: list
+) -> bytes:
+    keys = layer["keys"]
+    if len(keys) != rows or any(len(row) != columns for row in keys):
+        raise KeymapError(f"layer {layer['name']} keys must be {rows} x {columns}")
+    data = b"".join(action_record(action, names, layers) for row in keys for action in row)
+
+    for encoder in layer["encoders"]:
+        turn = encoder.get("turn", [])
+        acceleration = list(encoder.get("acceleration", [])) + [[0, 0], [0, 0]]
+        data += struct.pack(
+            ENCODER_HEADER,
+            len(turn),
+            encoder["button"]["pin"],
+            *acceleration[0],
+            *acceleration[1],
+        )
+        for slot in range(slots):
+            action = turn[slot] if slot < len(turn) else None
+            data += action_record(action, names, layers, turn=True)
+        data += action_record(encoder["button"].get("action"), names, layers)
+    return data
+
+
+def compile_keymap(source: dict) -> bytes:
+    rows = source["rows"]
+    columns = source["columns"]
+    layers = source["layers"]
+    num_encoders = len(layers[0]["encoders"])
+    slots = max(len(e.get("turn", [])) for layer in layers for e in layer["encoders"])
+    if any(len(layer["encoders"]) != num_encoders for layer in layers):
+        raise KeymapError("every layer must have the same number of encoders")
+
+    names = {}
+    layer_names = [layer["name"] for layer in layers]
+    for name in layer_names:
+        if len(name.encode()) > MAX_LAYER_NAME:
+            raise KeymapError(f"layer name {name} is longer than {MAX_LAYER_NAME} bytes")
+    bodies = [
+        compile_layer(layer, rows, columns, slots, names, layer_names) for layer in layers
+    ]
+    name_table = b""
+    for name in names:
+        encoded = name.encode()
+        name_table += bytes([len(encoded)]) + encoded
+
+    offset = struct.calcsize(KEYMAP_HEADER) + struct.calcsize(LAYER_ENTRY) * len(layers)
+    offset += len(name_table)
+    directory = b""
+    for layer, body in zip(layers, bodies):
+        directory += struct.pack(LAYER_ENTRY, layer["name"].encode(), offset)
+        offset += len(body)
+
+    header = struct.pack(
+        KEYMAP_HEADER,
+        KEYMAP_MAGIC,
+        KEYMAP_VERSION,
+        len(layers),
+        rows,
+        columns,
+        num_encoders,
+        slots,
+        len(names),
+    )
+    return header + directory + name_table + b"".join(bodies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="keymap JSON")
+    parser.add_argument("target", help="binary keymap, e.g. CIRCUITPY/keymap.bin")
+    args = parser.parse_args()
+
+    with open(args.source) as f:
+        source = json.load(f)
+    try:
+        data = compile_keymap(source)
+    except KeymapError as e:
+        sys.exit(f"{args.source}: {e}")
+
+    with open(args.target, "wb") as f:
+        f.write(data)
+    print(f"{args.target}: {len(source['layers'])} layers, {len(data)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import supervisor
+from array import array
+from events import TICKS_HALF, ticks_add, ticks_diff
+
+
+# Debounce algorithm
+class DebounceType:
+    EAGER = 1  # report change right away, then ignore the key for its debounce time
+    DEFERRED = 2  # report change after the key stayed the same for its debounce time
+    INTEGRATOR = 3  # count every sample up or down, report when counter reach its limit
+
+
+def now_ms() -> int:
+    # Small int, unlike time.monotonic_ns() it don't allocate on every sample
+    return supervisor.ticks_ms()
+
+
+def count_bits(mask: int) -> int:
+    count = 0
+    while mask:
+        mask &= mask - 1  # clear lowest set bit
+        count += 1
+    return count
+
+
+# Debounce bitmask snapshots of up to 32 keys (ButtonMatrix, ExpanderButtons),
+# every key have its own timer and its own debounce time.
+class Debouncer:
+    def __init__(
+        self,
+        num_keys: int,
+        algorithm: int = DebounceType.EAGER,
+        debounce: float = 0.005,
+        samples: int = 4,
+    ):
+        self.num_keys = num_keys
+        self.algorithm = algorithm
+        self.times = array("L", [int(debounce * 1000)] * num_keys)  # in ms, per key
+        # ms timestamp per key, start far enough in the past so first change is not ignored
+        self.changed_at = array("L", [ticks_add(now_ms(), 1 - TICKS_HALF)] * num_keys)
+        self.limits = bytearray([samples] * num_keys)  # integrator samples, per key
+        self.counters = bytearray(num_keys)  # integrator counter, per key
+        self.moving = 0  # keys with integrator counter between 0 and limit
+        self.raw = 0  # last raw snapshot
+        self.state = 0  # debounced state
+        self.raw_edges = 0  # changes seen in raw snapshots
+        self.edges = 0  # changes reported after debouncing
+
+    def set_key(self, index: int, debounce: float = None, samples: int = None):
+        """Override debounce time (seconds) or integrator samples for one key"""
+        if debounce is not None:
+            self.times[index] = int(debounce * 1000)
+        if samples is not None:
+            self.limits[index] = samples
+
+    @property
+    def suppressed(self) -> int:
+        """Number of raw changes that didn't become press or release"""
+        return self.raw_edges - self.edges
+
+    def is_settled(self) -> bool:
+        """True when debounced state already follow the raw state, so no more
+        update is needed until the raw state change."""
+        return self.raw == self.state and not self.moving
+
+    def update(self, raw: int) -> int:
+        """Feed raw snapshot, return debounced snapshot"""
+        raw_changed = raw ^ self.raw
+        self.raw = raw
+        if raw_changed:
+            self.raw_edges += count_bits(raw_changed)
+
+        if self.algorithm == DebounceType.EAGER:
+            state = self.update_eager(raw)
+        elif self.algorithm == DebounceType.DEFERRED:
+            state = self.update_deferred(raw, raw_changed)
+        else:
+            state = self.update_integrator(raw)
+
+        if state != self.state:
+            self.edges += count_bits(state ^ self.state)
+            self.state = state
+        return state
+
+    def is_recent(self, bit: int, now: int) -> bool:
+        """Key changed less than its debounce time ago. A negative age is a change
+        more than TICKS_HALF ago, timestamps are never in the future."""
+        return 0 <= ticks_diff(now, self.changed_at[bit]) < self.times[bit]
+
+    def update_eager(self, raw: int) -> int:
+        state = self.state
+        pending = raw ^ state
+        if not pending:
+            return state
+
+        now = now_ms()
+        bit = 0
+        while pending:
+            if pending & 1 and not self.is_recent(bit, now):
+                state ^= 1 << bit
+                self.changed_at[bit] = now
+            pending >>= 1
+            bit += 1
+        return state
+
+    def update_deferred(self, raw: int, raw_changed: int) -> int:
+        state = self.state
+        pending = raw ^ state
+        if not pending:
+            return state
+
+        now = now_ms()
+        # Restart the timer of keys whose raw value changed in this snapshot
+        bit = 0
+        while pending:
+            if pending & 1:
+                if (raw_changed >> bit) & 1:
+                    self.changed_at[bit] = now
+                elif not self.is_recent(bit, now):
+                    state ^= 1 << bit
+            pending >>= 1
+            bit += 1
+        return state
+
+    def update_integrator(self, raw: int) -> int:
+        state = self.state
+        active = (raw ^ state) | self.moving
+        bit = 0
+        while active:
+            if active & 1:
+                mask = 1 << bit
+                counter = self.counters[bit]
+                if raw & mask:
+                    counter = min(counter + 1, self.limits[bit])
+                else:
+                    counter = max(counter - 1, 0)
+                self.counters[bit] = counter
+
+                if counter == self.limits[bit]:
+                    state |= mask
+                    self.moving &= ~mask
+                elif counter == 0:
+                    state &= ~mask
+                    self.moving &= ~mask
+                else:
+                    self.moving |= mask
+            active >>= 1
+            bit += 1
+        return state
@@ -1,32 +1,79 @@
-import os
+import time
 
 DEFAULT_DIGITAL_VOLUME = 50
 MIN_DIGITAL_VOLUME = 0
 MAX_DIGITAL_VOLUME = 100
 MAX_ANALOG_VOLUME = 1023
+BINARY_FRAME_START = 0xDE  # start, count, u16 little endian volume * count, checksum
+HOST_FRAME_START = 0xDF  # start, HostOp, program index, length, payload * length, checksum
+MAX_NAME_LENGTH = 15
+
+
+# Frames sent by the host (deej-host/deej_sync.py) about its audio sessions
+class HostOp:
+    VOLUME = 1  # payload is u8 volume 0-100 set on the host
+    NAME = 2  # payload is utf-8 session name, empty when the session is gone
+    SYNC = 3  # no payload, host want all the volumes sent again
 
 
 class Deej:
-    def __init__(self, programs: list):
-        self.programs = programs  # Display name for program in list
+    def __init__(
+        self, programs: list, serial=None, binary: bool = False, store=None
+    ):
+        self.programs = list(programs)  # Display name for program in list
         self.num_programs = len(programs)
         self.volumes = [DEFAULT_DIGITAL_VOLUME for i in self.programs]
         self.current_program_index = 0
         self.display = self.refresh_display()
 
-    def create_or_get_volumes(self):
-        """Create or get volume from csv file, so we can get latest volume instead of all volume return to default value.
-        (Not working since circuitpython? don't allow to write text file.)
-        """
-
-        filename = "deej.csv"
-        if filename not in os.listdir("/"):
-            with open(filename, "w") as f:
-                data = ",".join(str(DEFAULT_DIGITAL_VOLUME) for i in self.num_programs)
-                f.write(data)
+        # usb_cdc.data, None mean print to the console like the original deej sketch
+        self.serial = serial
+        self.binary = binary
+        if binary:
+            self.buffer = bytearray(3 + self.num_programs * 2)
         else:
-            with open(filename, "r") as file:
-                self.volumes = file.strip().split(",")
+            self.buffer = bytearray(self.num_programs * 5 + 1)  # "1023|" * n + "\n"
+        self.changed = True  # send the volumes once at start
+        self.received = bytearray(5 + MAX_NAME_LENGTH)  # host frame being read
+        self.received_length = 0
+        self.read_buffer = bytearray(32)
+        self.updated = bytearray(self.num_programs)  # programs changed by the host
+
+        self.saved_payload = bytearray(1 + self.num_programs)  # program, volumes
+        self.restore(store)
+
+    def restore(self, store):
+        """Load the last saved program and volumes from record_log.RecordLog.
+        Saved by save() so the volumes don't go back to default at every start."""
+        self.store = store
+        self.unsaved_since = None  # time.monotonic_ns() of the first unsaved change
+        if store is None:
+            return
+        saved = store.load()
+        if saved is None or saved[0] >= self.num_programs:
+            return
+        self.current_program_index = saved[0]
+        for index in range(self.num_programs):
+            self.volumes[index] = self.clamp(saved[1 + index])
+        self.display = self.refresh_display()
+
+    def mark_unsaved(self):
+        if self.unsaved_since is None:
+            self.unsaved_since = time.monotonic_ns()
+
+    # Put this in scheduler, a burst of changes is written once after `delay`
+    def save(self, delay: float):
+        """Write the volumes to the store when nothing changed for `delay` seconds"""
+        if self.unsaved_since is None or self.store is None:
+            return
+        if time.monotonic_ns() - self.unsaved_since < int(delay * 1e9):
+            return
+        self.unsaved_since = None
+        payload = self.saved_payload
+        payload[0] = self.current_program_index
+        for index in range(self.num_programs):
+            payload[1 + index] = self.volumes[index]
+        self.store.save(payload)
 
     def refresh_display(self):
         return f"{self.volumes[self.current_program_index]}\n{self.programs[self.current_program_index]}"
@@ -37,6 +84,7 @@ class Deej:
             self.current_program_index + direction
         ) % self.num_programs
         # print(f"current = {self.current_program_index}")
+        self.mark_unsaved()
         self.display = self.refresh_display()
 
     def clamp(self, val, min_val=MIN_DIGITAL_VOLUME, max_val=MAX_DIGITAL_VOLUME):
@@ -44,14 +92,125 @@ class Deej:
 
     def analog_value(self, value: int):
         """Convert digital value to potentiometer analog value."""
-        return round(value * MAX_ANALOG_VOLUME / MAX_DIGITAL_VOLUME)
+        half = MAX_DIGITAL_VOLUME // 2
+        return (value * MAX_ANALOG_VOLUME + half) // MAX_DIGITAL_VOLUME
+
+    def fill_text(self) -> int:
+        """Write "v1|v2|...\\n" into the buffer, return its length"""
+        buffer = self.buffer
+        i = 0
+        for index in range(self.num_programs):
+            if index:
+                buffer[i] = 0x7C  # "|"
+                i += 1
+            value = self.analog_value(self.volumes[index])
+            divisor = 1000
+            while divisor > 1 and value < divisor:
+                divisor //= 10
+            while divisor:
+                buffer[i] = 0x30 + value // divisor % 10
+                i += 1
+                divisor //= 10
+        buffer[i] = 0x0A  # "\n"
+        return i + 1
+
+    def fill_binary(self) -> int:
+        buffer = self.buffer
+        buffer[0] = BINARY_FRAME_START
+        buffer[1] = self.num_programs
+        for index in range(self.num_programs):
+            value = self.analog_value(self.volumes[index])
+            buffer[2 + index * 2] = value & 0xFF
+            buffer[3 + index * 2] = value >> 8
+        checksum = 0
+        for i in range(len(buffer) - 1):
+            checksum += buffer[i]
+        buffer[-1] = checksum & 0xFF
+        return len(buffer)
 
     def send_to_serial(self):
         """Send value to serial for Deej desktop program can read it."""
-        analog_value = [self.analog_value(v) for v in self.volumes]
-        volumes = map(str, analog_value)
-        serialize = "|".join(volumes)
-        print(serialize)
+        length = self.fill_binary() if self.binary else self.fill_text()
+        if self.serial is None:
+            print(self.buffer[: length - 1].decode())
+        elif length == len(self.buffer):
+            self.serial.write(self.buffer)
+        else:
+            self.serial.write(memoryview(self.buffer)[:length])
+
+    # Put this in scheduler, the task period is the max send rate
+    def flush(self):
+        """Send the volumes once for every change made since the last flush"""
+        if not self.changed:
+            return
+        if self.serial is not None and not self.serial.connected:
+            return  # keep it pending until the host open the port
+        self.changed = False
+        self.send_to_serial()
+
+    # Put this in scheduler before flush()
+    def poll(self):
+        """Read the host frames waiting on serial, only the programs named in them
+        are changed and flagged in `updated` so their labels can be redrawn"""
+        serial = self.serial
+        if serial is None:
+            return
+        while serial.in_waiting:
+            count = serial.readinto(self.read_buffer)
+            if not count:
+                break
+            for i in range(count):
+                self.receive_byte(self.read_buffer[i])
+
+    def receive_byte(self, byte: int):
+        frame = self.received
+        length = self.received_length
+        if length == 0 and byte != HOST_FRAME_START:
+            return  # skip until the start of a frame
+        if length == 3 and byte > MAX_NAME_LENGTH:
+            self.received_length = 0  # corrupted length
+            return
+        frame[length] = byte
+        length += 1
+        if length < 4 or length < 5 + frame[3]:
+            self.received_length = length
+            return
+
+        self.received_length = 0
+        checksum = 0
+        for i in range(length - 1):
+            checksum += frame[i]
+        if checksum & 0xFF == byte:
+            self.apply_host_frame(frame[1], frame[2], frame[3])
+
+    def apply_host_frame(self, op: int, index: int, length: int):
+        if op == HostOp.SYNC:
+            self.changed = True
+            return
+        if index >= self.num_programs:
+            return
+        if op == HostOp.VOLUME:
+            volume = self.clamp(self.received[4])
+            if volume == self.volumes[index]:
+                return
+            self.volumes[index] = volume  # not sent back, the host already has it
+            self.mark_unsaved()
+        elif op == HostOp.NAME:
+            try:
+                name = self.received[4 : 4 + length].decode() if length else "-"
+            except UnicodeError:
+                return  # not UTF-8, drop the frame
+            if name == self.programs[index]:
+                return
+            self.programs[index] = name
+        else:
+            return
+        self.updated[index] = 1
+        if index == self.current_program_index:
+            self.display = self.refresh_display()
+
+    def label_text(self, index: int) -> str:
+        return f"{self.volumes[index]} - {self.programs[index]}"
 
     def change_volume(self, direction: int):
         # direction value is +2 or -2
@@ -59,5 +218,6 @@ class Deej:
         self.volumes[self.current_program_index] = self.clamp(
             program_volume + direction
         )
-        self.send_to_serial()
+        self.changed = True  # sent by flush(), many detents in one period are sent once
+        self.mark_unsaved()
         self.display = self.refresh_display()
@@ -1,5 +1,8 @@
+import gc
 import busio
+import struct
 import displayio
+import bitmaptools
 import pwmio
 import os
 import terminalio
@@ -10,12 +13,32 @@ from adafruit_st7789 import ST7789
 from adafruit_bitmap_font import bitmap_font
 from adafruit_display_text.outlined_label import OutlinedLabel
 
+MEDIA_FOLDER = "/media"
+SLIDESHOW_MANIFEST = "slideshow.txt"  # one BMP file name per line, in MEDIA_FOLDER
 
+
+# Display is refreshed manually. Widgets changes are only collected (set_text,
+# mark_dirty) and pushed in one refresh per frame by refresh_frame().
 class DisplayScreen:
     def __init__(
-        self, pin_clock, pin_mosi, pin_cs, pin_dc, pin_reset, pin_bl, rotation=0
+        self,
+        pin_clock,
+        pin_mosi,
+        pin_cs,
+        pin_dc,
+        pin_reset,
+        pin_bl,
+        rotation=0,
+        max_fps=20,
+        duty=0.25,
     ):
         self.rotation = rotation
+        self.frame_time = int(1_000_000_000 / max_fps)  # in nanoseconds
+        self.duty = duty  # max fraction of time spent in refresh
+        self.pending_texts = {}  # label -> text, applied on next frame
+        self.dirty = False
+        self.next_refresh = 0
+        self.refreshes = 0
         self.current_brightness_level = 3  # default brightness level
         self.levels = [
             0,
@@ -39,9 +62,9 @@ class DisplayScreen:
         self.texts_group = displayio.Group()
 
     def change_brightness(self, direction):
-        # direction value is +1 or -1
+        # direction is the number of levels to move, negative is darker (encoder detents)
         index = self.current_brightness_level + direction
-        self.current_brightness_level = index % 10
+        self.current_brightness_level = max(0, min(len(self.levels) - 1, index))
         self.brightness.duty_cycle = self.levels[self.current_brightness_level]
 
     def init_spi_bus(self, pin_clock, pin_mosi):
@@ -69,6 +92,7 @@ class DisplayScreen:
             bgr=True,
             invert=True,
             rotation=self.rotation,
+            auto_refresh=False,
         )
         return display
 
@@ -95,6 +119,41 @@ class DisplayScreen:
         self.group.append(self.gif_group)
         self.group.append(self.texts_group)
         self.display.root_group = self.group
+        self.dirty = True
+
+    def set_text(self, label, text):
+        """Change label text on the next frame, only the last text is drawn
+        when it's changed many times in one frame."""
+        if label.text == text:
+            self.pending_texts.pop(label, None)
+        else:
+            self.pending_texts[label] = text
+
+    def mark_dirty(self):
+        """Call after changing a group or bitmap, so the next frame refresh it"""
+        self.dirty = True
+
+    def refresh_frame(self) -> bool:
+        """Put this in scheduler. Refresh the display at most once per frame,
+        and wait longer after slow refresh so it use at most `duty` of the time."""
+        if not (self.dirty or self.pending_texts):
+            return False
+
+        now = time.monotonic_ns()
+        if now < self.next_refresh:
+            return False
+
+        for label, text in self.pending_texts.items():
+            label.text = text
+        self.pending_texts.clear()
+        self.dirty = False
+
+        self.display.refresh()
+        self.refreshes += 1
+        end = time.monotonic_ns()
+        cost = end - now
+        self.next_refresh = now + max(self.frame_time, int(cost / self.duty))
+        return True
 
     def label(self, text, x, y):
         # Set text, font, and color
@@ -114,75 +173,254 @@ class DisplayScreen:
         return text_area
 
 
+GIF_PACK_MAGIC = b"GFP1"
+GIF_PACK_HEADER = "<4sHHH"  # magic, width, height, frame count
+GIF_RAM_RESERVE = 40_000  # bytes left free for the rest of the firmware after caching frames
+
+
+def read_gif_pack_header(file):
+    """Frame pack is made on the PC from a GIF: header, u16 delay of every
+    frame in ms, then every frame as raw big endian RGB565 (RGB565_SWAPPED when
+    read as little endian u16)."""
+    header = file.read(struct.calcsize(GIF_PACK_HEADER))
+    magic, width, height, count = struct.unpack(GIF_PACK_HEADER, header)
+    if magic != GIF_PACK_MAGIC:
+        raise ValueError("Not a GIF frame pack")
+    delays = struct.unpack(f"<{count}H", file.read(count * 2))
+    return width, height, [delay * 1_000_000 for delay in delays]
+
+
+# Frames decoded once and kept in RAM
+class RamFrames:
+    def __init__(self, bitmaps: list):
+        self.bitmaps = bitmaps
+
+    def load(self, index: int, bitmap):
+        bitmaptools.blit(bitmap, self.bitmaps[index], 0, 0)
+
+
+# Raw frames read straight from frame pack file, no decoding
+class PackFrames:
+    def __init__(self, file, width: int, height: int):
+        self.file = file
+        self.offset = file.tell()  # first frame start right after the delays
+        self.frame_size = width * height * 2
+
+    def load(self, index: int, bitmap):
+        self.file.seek(self.offset + index * self.frame_size)
+        bitmaptools.readinto(bitmap, self.file, 16, element_size=2)
+
+
+# Last resort when the frames don't fit in RAM and there's no frame pack,
+# every frame is decoded from the GIF when it's shown
+class GifFrames:
+    def __init__(self, odg):
+        self.odg = odg
+        self.index = 0
+
+    def load(self, index: int, bitmap):
+        # GIF can only be decoded in order, skipped frames still have to be decoded
+        while self.index != index:
+            self.odg.next_frame()
+            self.index = (self.index + 1) % self.odg.frame_count
+        self.odg.next_frame()
+        self.index = (self.index + 1) % self.odg.frame_count
+
+
+# Play GIF with precomputed frame delays. Frames come from RAM when they fit,
+# else from a frame pack (same name as the GIF with .gfp extension) and else
+# they are decoded from the GIF. Frames are only skipped when input is busy.
 class PlayGif:
-    def __init__(self, gif_file, group, display):
+    def __init__(self, gif_file, group, screen: DisplayScreen):
         self.group = group
-        self.display = display
-        self.odg = gifio.OnDiskGif(gif_file)
+        self.screen = screen
+        self.odg = None
 
-        start = time.monotonic()
-        self.next_delay = self.odg.next_frame()  # Load the first frame
-        end = time.monotonic()
-        self.overhead = end - start
+        pack_file = gif_file.rsplit(".", 1)[0] + ".gfp"
+        try:
+            source = open(pack_file, "rb")
+        except OSError:
+            source = None
+
+        if source is not None:
+            width, height, self.delays = read_gif_pack_header(source)
+            self.bitmap = displayio.Bitmap(width, height, 65535)
+            self.frames = PackFrames(source, width, height)
+        else:
+            self.odg = gifio.OnDiskGif(gif_file)
+            width, height = self.odg.width, self.odg.height
+            self.bitmap = self.odg.bitmap
+            self.delays = None  # only known after every frame is decoded
+            self.frames = GifFrames(self.odg)
+
+        count = self.odg.frame_count if self.odg else len(self.delays)
+        if width * height * 2 * count + GIF_RAM_RESERVE < gc.mem_free():
+            self.frames = self.cache_frames(width, height, count)
+            self.bitmap = displayio.Bitmap(width, height, 65535)
+            if source is not None:
+                source.close()
+
+        if self.delays is None:
+            self.delays = [int(self.odg.next_frame() * 1_000_000_000)]
+            for _ in range(count - 1):
+                self.delays.append(int(self.odg.next_frame() * 1_000_000_000))
+
+        self.index = 0
+        self.frames.load(0, self.bitmap)
+        self.shown = 0
+        self.skipped = 0
 
         self.face = displayio.TileGrid(
-            self.odg.bitmap,
+            self.bitmap,
             pixel_shader=displayio.ColorConverter(
                 input_colorspace=displayio.Colorspace.RGB565_SWAPPED
             ),
         )
         self.group.append(self.face)
-        self.display.refresh()
+        self.screen.mark_dirty()
+        self.next_update_time = time.monotonic_ns() + self.delays[0]
 
-        self.next_update_time = time.monotonic() + max(
-            0, self.next_delay - self.overhead
-        )
+    def cache_frames(self, width, height, count) -> RamFrames:
+        bitmaps = []
+        delays = []
+        for i in range(count):
+            bitmap = displayio.Bitmap(width, height, 65535)
+            if self.odg is None:
+                self.frames.load(i, bitmap)
+            else:
+                delays.append(int(self.odg.next_frame() * 1_000_000_000))
+                bitmaptools.blit(bitmap, self.odg.bitmap, 0, 0)
+            bitmaps.append(bitmap)
 
-    def update_gif(self):
-        now = time.monotonic()
-        if now >= self.next_update_time:
-            start = time.monotonic()
-            self.next_delay = self.odg.next_frame()
-            end = time.monotonic()
-            self.overhead = end - start
+        if self.odg is not None:
+            self.delays = delays
+            self.odg.deinit()
+            self.odg = None
+        return RamFrames(bitmaps)
+
+    def update_gif(self, busy: bool = False) -> bool:
+        """Put this in scheduler. `busy` mean input need the time, then frames that
+        are already late are skipped. Otherwise every frame is shown and the
+        animation slow down when the display can't keep up."""
+        now = time.monotonic_ns()
+        if now < self.next_update_time:
+            return False
+        if self.screen.dirty:
+            return False  # last frame is not on the display yet
 
-            self.display.refresh()
-            self.next_update_time = now + max(0, self.next_delay - self.overhead)
+        count = len(self.delays)
+        index = (self.index + 1) % count
+        due = self.next_update_time + self.delays[index]
+        if busy:
+            while due <= now:
+                index = (index + 1) % count
+                due += self.delays[index]
+                self.skipped += 1
+        elif due <= now:
+            due = now + self.delays[index]  # late, start the schedule again from now
 
+        self.index = index
+        self.next_update_time = due
+        self.frames.load(index, self.bitmap)
+        self.screen.mark_dirty()
+        self.shown += 1
+        return True
 
+
+# Show the BMP images of MEDIA_FOLDER one after another. Images listed in the
+# manifest (made by image-to-bmp/build_assets.py) are used when it exist, so the
+# folder doesn't have to be listed at boot. Recently shown and the next image
+# are kept open in a small LRU cache, the next one is opened on idle ticks.
 class Slideshow:
-    def __init__(self, group):
-        folder = "/media"
+    def __init__(self, group, dwell=60, cache_size=2):
         self.group = group  # get group from DisplayScreen
-        self.dwell = 60
-        self.images = [
-            folder + "/" + f
-            for f in os.listdir(folder)
-            if (not f.startswith(".") and (f.endswith(".bmp")))
-        ]
+        self.dwell = dwell
+        self.cache_size = max(2, cache_size)  # at least the shown and the next image
+        self.cache = {}  # path -> (file, TileGrid)
+        self.recent = []  # cached paths, least recently used first
+        self.images = self.list_images(MEDIA_FOLDER)
         self.num_images = len(self.images)
         self.last_time = time.monotonic()
         self.index = 0
-        self.show_image(self.images[self.index])  # show first image for the first time
+        self.shown = None
+        if self.images:
+            self.show_image(self.images[self.index])  # show first image for the first time
 
-    def show_image(self, image_file):
-        bitmap = displayio.OnDiskBitmap(image_file)
+    @staticmethod
+    def list_images(folder) -> list:
+        try:
+            with open(folder + "/" + SLIDESHOW_MANIFEST) as f:
+                names = [line.strip() for line in f]
+        except OSError:
+            try:
+                names = sorted(os.listdir(folder))
+            except OSError:
+                return []  # no media folder, nothing to show
+        return [
+            folder + "/" + name
+            for name in names
+            if name and not name.startswith(".") and name.endswith(".bmp")
+        ]
+
+    def open_image(self, image_file):
+        """Return TileGrid of the image, opened image stay cached until it's the
+        least recently used one."""
+        if image_file in self.cache:
+            self.recent.remove(image_file)
+            self.recent.append(image_file)
+            return self.cache[image_file][1]
+
+        while len(self.recent) >= self.cache_size:
+            oldest = self.recent.pop(0)
+            old_file, old_tile_grid = self.cache.pop(oldest)
+            if old_tile_grid is self.shown:
+                # Never close the image on screen, put it back as most recent
+                self.cache[oldest] = (old_file, old_tile_grid)
+                self.recent.append(oldest)
+                continue
+            old_file.close()
+
+        file = open(image_file, "rb")
+        bitmap = displayio.OnDiskBitmap(file)
         # Create tile grid to hold image
         tile_grid = displayio.TileGrid(bitmap, pixel_shader=bitmap.pixel_shader)
-        self.group.append(tile_grid)
+        self.cache[image_file] = (file, tile_grid)
+        self.recent.append(image_file)
+        return tile_grid
 
-    def clamp(self):
-        self.index = (self.index + 1) % self.num_images
+    def show_image(self, image_file):
+        tile_grid = self.open_image(image_file)
+        if self.shown is None:
+            self.group.append(tile_grid)
+        else:
+            self.group[self.group.index(self.shown)] = tile_grid
+        self.shown = tile_grid
+
+    def next_image(self):
+        return self.images[(self.index + 1) % self.num_images]
+
+    def prefetch(self):
+        """Open the next image ahead of time, call it when nothing else is running"""
+        if self.num_images > 1 and self.next_image() not in self.cache:
+            self.open_image(self.next_image())
 
     def advance(self):
-        self.clamp()
-        self.group.pop()
+        self.index = (self.index + 1) % self.num_images
         self.show_image(self.images[self.index])
 
-    def update(self) -> bool:
-        """Updates the slideshow to the next image."""
+    def update(self, busy: bool = False) -> bool:
+        """Updates the slideshow to the next image, return True when image changed.
+        While `busy` (input is active) the change wait for a later tick."""
+        if self.num_images < 2:
+            return False
         now = time.monotonic()
-        if now - self.last_time >= self.dwell:
-            # return True
-            self.last_time = now
-            return self.advance()
+        if now - self.last_time < self.dwell:
+            if not busy:
+                self.prefetch()
+            return False
+        if busy:
+            return False
+
+        self.last_time = now
+        self.advance()
+        return True
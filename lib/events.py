@@ -0,0 +1,69 @@
+import supervisor
+from array import array
+
+TICKS_MASK = 0x1FFFFFFF  # supervisor.ticks_ms() wrap around at 2**29
+TICKS_HALF = (TICKS_MASK + 1) >> 1
+
+
+def ticks_add(ticks: int, delta: int) -> int:
+    """supervisor.ticks_ms() value delta ms after ticks"""
+    return (ticks + delta) & TICKS_MASK
+
+
+def ticks_diff(end: int, start: int) -> int:
+    """Signed ms from start to end, right across the wrap if they are less than
+    TICKS_HALF (about 3 days) apart, same as adafruit_ticks.ticks_diff"""
+    return ((end - start + TICKS_HALF) & TICKS_MASK) - TICKS_HALF
+
+
+# Who pushed the event, also index of its handler in EventQueue.handlers
+class EventSource:
+    MATRIX = 0  # index is key bit (row * columns + column), value 1 press 0 release
+    BUTTONS = 1  # index is encoder button, value 1 press 0 release
+    ENCODER = 2  # index is SplitRotaryEncoder number, value is detents -128..127
+
+
+# Fixed size ring buffer of input events in arrays, so pushing and dispatching don't
+# allocate. Scanning tasks only push events, the "dispatch" task run the actions,
+# so a slow action (HID, display, layer switch) doesn't stall the scan.
+class EventQueue:
+    def __init__(self, capacity: int = 64, delay_histogram=None):
+        self.capacity = capacity
+        self.sources = bytearray(capacity)
+        self.indexes = bytearray(capacity)
+        self.values = array("b", [0] * capacity)
+        self.times = array("L", [0] * capacity)  # supervisor.ticks_ms() of the push
+        self.head = 0  # next event to dispatch
+        self.count = 0
+        self.overflows = 0  # events that didn't fit, the producer retry them later
+        self.handlers = [None, None, None]  # per EventSource, handler(index, value)
+        self.time = 0  # supervisor.ticks_ms() push time of the event being dispatched
+        # profiler.Histogram of the time events wait in the queue, None to skip it
+        self.delay_histogram = delay_histogram
+
+    def push(self, source: int, index: int, value: int) -> bool:
+        """Add event, False when the queue is full"""
+        if self.count == self.capacity:
+            self.overflows += 1
+            return False
+        tail = (self.head + self.count) % self.capacity
+        self.sources[tail] = source
+        self.indexes[tail] = index
+        self.values[tail] = value
+        self.times[tail] = supervisor.ticks_ms()
+        self.count += 1
+        return True
+
+    # Put this in scheduler
+    def dispatch(self):
+        """Run the handler of every queued event, oldest first"""
+        histogram = self.delay_histogram
+        while self.count:
+            head = self.head
+            self.head = (head + 1) % self.capacity
+            self.count -= 1
+            if histogram is not None:
+                delay = ticks_diff(supervisor.ticks_ms(), self.times[head])
+                histogram.add(delay * 1_000_000)
+            self.time = self.times[head]
+            self.handlers[self.sources[head]](self.indexes[head], self.values[head])
@@ -0,0 +1,183 @@
+from adafruit_hid import find_device
+
+MODIFIER_FIRST = 0xE0  # Keycode.LEFT_CONTROL
+MODIFIER_LAST = 0xE7  # Keycode.RIGHT_GUI
+BOOT_KEYS = 6  # key slots in 6KRO boot keyboard report
+NKRO_REPORT_LENGTH = 16  # modifiers + bitmap of usage 0x00-0x77, see boot.py
+NKRO_MAX_KEYCODE = (NKRO_REPORT_LENGTH - 1) * 8 - 1
+
+
+# Collect every key, consumer control and mouse change of one scan tick and send
+# at most one report per HID device when flush() is called.
+class HIDReport:
+    def __init__(self, devices, nkro: bool = False):
+        self.keyboard = find_device(devices, usage_page=0x01, usage=0x06)
+        self.mouse = find_device(devices, usage_page=0x01, usage=0x02)
+        self.consumer_control = find_device(devices, usage_page=0x0C, usage=0x01)
+
+        self.key_counts = bytearray(256)  # how many pressed buttons hold each keycode
+        self.held = []  # non modifier keycodes in the order they were pressed
+        self.modifiers = 0
+        self.keyboard_changed = False
+        self.taps = []  # queue of chords from send(), each is pressed for one report
+        self.tap = None  # chord of the tap that is pressed in the last report
+        self.overflows = 0  # keys that didn't fit in 6KRO report and had to wait
+        self.set_nkro(nkro)
+
+        self.consumer_codes = []  # queue of codes from send_consumer()
+        self.consumer_pressed = False
+        self.consumer_report = bytearray(2)
+
+        self.mouse_buttons = 0
+        self.mouse_x = 0
+        self.mouse_y = 0
+        self.mouse_wheel = 0
+        self.mouse_changed = False
+        self.mouse_report = bytearray(4)
+
+    def set_nkro(self, nkro: bool):
+        """NKRO need the bitmap keyboard descriptor enabled in boot.py"""
+        self.nkro = nkro
+        self.keyboard_report = bytearray(NKRO_REPORT_LENGTH if nkro else 8)
+        self.keyboard_changed = True
+
+    # Keyboard
+    def press(self, *keycodes):
+        self.press_keys(keycodes)
+
+    def release(self, *keycodes):
+        self.release_keys(keycodes)
+
+    def press_keys(self, keycodes):
+        """Same as press() but take sequence of keycodes, no argument tuple is made"""
+        for keycode in keycodes:
+            self.key_counts[keycode] += 1
+            if self.key_counts[keycode] > 1:
+                continue  # already held by other button
+
+            if MODIFIER_FIRST <= keycode <= MODIFIER_LAST:
+                self.modifiers |= 1 << (keycode - MODIFIER_FIRST)
+            else:
+                self.held.append(keycode)
+                if not self.nkro and len(self.held) > BOOT_KEYS:
+                    self.overflows += 1
+            self.keyboard_changed = True
+
+    def release_keys(self, keycodes):
+        for keycode in keycodes:
+            if not self.key_counts[keycode]:
+                continue
+            self.key_counts[keycode] -= 1
+            if self.key_counts[keycode]:
+                continue  # still held by other button
+
+            if MODIFIER_FIRST <= keycode <= MODIFIER_LAST:
+                self.modifiers &= ~(1 << (keycode - MODIFIER_FIRST))
+            else:
+                self.held.remove(keycode)
+            self.keyboard_changed = True
+
+    def send(self, *keycodes):
+        """Press and release chord, like Keyboard.send. Every chord in the queue
+        take two reports, one to press and one to release it."""
+        self.taps.append(keycodes)
+
+    def fill_keyboard_report(self):
+        report = self.keyboard_report
+        report[0] = self.modifiers
+        for i in range(1, len(report)):
+            report[i] = 0
+
+        if self.nkro:
+            for keycode in self.held:
+                if keycode <= NKRO_MAX_KEYCODE:
+                    report[1 + (keycode >> 3)] |= 1 << (keycode & 7)
+        else:
+            # Keys pressed after the first six wait until a slot is free
+            held = self.held
+            for slot in range(min(len(held), BOOT_KEYS)):
+                report[2 + slot] = held[slot]
+
+    def flush_keyboard(self):
+        if self.tap is not None:
+            self.release_keys(self.tap)
+            self.tap = None
+        elif self.taps:
+            self.tap = self.taps.pop(0)
+            self.press_keys(self.tap)
+
+        if self.keyboard_changed:
+            self.fill_keyboard_report()
+            self.keyboard.send_report(self.keyboard_report)
+            self.keyboard_changed = False
+
+    # Consumer control
+    def send_consumer(self, code: int):
+        """Press and release consumer control code, like ConsumerControl.send"""
+        self.consumer_codes.append(code)
+
+    def flush_consumer_control(self):
+        report = self.consumer_report
+        if self.consumer_pressed:
+            report[0] = report[1] = 0
+            self.consumer_pressed = False
+        elif self.consumer_codes:
+            code = self.consumer_codes.pop(0)
+            report[0] = code & 0xFF
+            report[1] = code >> 8
+            self.consumer_pressed = True
+        else:
+            return
+        self.consumer_control.send_report(report)
+
+    # Mouse
+    def move(self, x: int = 0, y: int = 0, wheel: int = 0):
+        self.mouse_x += x
+        self.mouse_y += y
+        self.mouse_wheel += wheel
+        self.mouse_changed = True
+
+    def mouse_press(self, buttons: int):
+        self.mouse_buttons |= buttons
+        self.mouse_changed = True
+
+    def mouse_release(self, buttons: int):
+        self.mouse_buttons &= ~buttons
+        self.mouse_changed = True
+
+    def flush_mouse(self):
+        if not self.mouse_changed:
+            return
+
+        # Report only fit -127..127, the rest is sent in next report
+        x = max(-127, min(127, self.mouse_x))
+        y = max(-127, min(127, self.mouse_y))
+        wheel = max(-127, min(127, self.mouse_wheel))
+        self.mouse_x -= x
+        self.mouse_y -= y
+        self.mouse_wheel -= wheel
+        self.mouse_changed = bool(self.mouse_x or self.mouse_y or self.mouse_wheel)
+
+        report = self.mouse_report
+        report[0] = self.mouse_buttons
+        report[1] = x & 0xFF
+        report[2] = y & 0xFF
+        report[3] = wheel & 0xFF
+        self.mouse.send_report(report)
+
+    def pending(self) -> bool:
+        """True when there are changes or queued taps waiting for flush()"""
+        return bool(
+            self.keyboard_changed
+            or self.tap is not None
+            or self.taps
+            or self.consumer_pressed
+            or self.consumer_codes
+            or self.mouse_changed
+        )
+
+    # Put this in scheduler, once per tick
+    def flush(self):
+        self.flush_keyboard()
+        self.flush_consumer_control()
+        self.flush_mouse()
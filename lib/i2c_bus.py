@@ -0,0 +1,133 @@
+import busio
+
+PROBE_READS = 3  # reads of every device that must agree at startup
+
+
+# Owner of the I2C bus shared by the PCF8574 expanders. It look like busio.I2C, so
+# PCF8574(bus, address) work as before, but the bus is locked once at start and
+# stay locked (nothing else use it), so try_lock/unlock around every pin access
+# cost nothing. Every transaction and byte is counted per device address.
+class I2CBus:
+    def __init__(
+        self,
+        scl,
+        sda,
+        frequency: int = 400_000,
+        fallback_frequency: int = 100_000,
+        addresses: tuple = (),
+        input_masks: tuple = None,
+    ):
+        """input_masks has the pins of every device in addresses that are key
+        inputs, they can change between the probe reads so they aren't compared."""
+        self.scl = scl
+        self.sda = sda
+        self.transactions = {address: 0 for address in addresses}
+        self.bytes = {address: 0 for address in addresses}
+        self.probe_buffer = bytearray(len(addresses))
+        self.probe_masks = bytes(  # bits of every device that must read the same
+            0xFF & ~mask for mask in (input_masks or bytes(len(addresses)))
+        )
+
+        self.i2c = None
+        self.frequency = frequency
+        if not self.start(frequency, addresses) and fallback_frequency != frequency:
+            print(f"I2C at {frequency} Hz failed, using {fallback_frequency} Hz")
+            self.frequency = fallback_frequency
+            if not self.start(fallback_frequency, addresses):
+                print(f"I2C devices not found: {[hex(a) for a in addresses]}")
+
+    def start(self, frequency: int, addresses: tuple) -> bool:
+        """Create the bus at frequency and check every device answer the same
+        value PROBE_READS times, a too fast clock give errors or garbage. Only the
+        pins that aren't inputs are compared, a key held or bouncing at boot would
+        look like garbage."""
+        if self.i2c is not None:
+            self.i2c.unlock()
+            self.i2c.deinit()
+        self.i2c = busio.I2C(self.scl, self.sda, frequency=frequency)
+        while not self.i2c.try_lock():
+            pass
+
+        try:
+            found = self.i2c.scan()
+            if any(address not in found for address in addresses):
+                return False
+            first = bytearray(len(addresses))
+            self.read_many(addresses, first)
+            for _ in range(PROBE_READS - 1):
+                self.read_many(addresses, self.probe_buffer)
+                for i in range(len(addresses)):
+                    if (self.probe_buffer[i] ^ first[i]) & self.probe_masks[i]:
+                        return False
+        except OSError as e:
+            print(e)
+            return False
+        return True
+
+    def count(self, address: int, nbytes: int):
+        if address in self.transactions:
+            self.transactions[address] += 1
+            self.bytes[address] += nbytes
+        else:
+            self.transactions[address] = 1
+            self.bytes[address] = nbytes
+
+    def read_many(self, addresses: tuple, buffer: bytearray):
+        """Read one byte from every device back to back, buffer[i] is addresses[i]"""
+        i2c = self.i2c
+        for i, address in enumerate(addresses):
+            i2c.readfrom_into(address, buffer, start=i, end=i + 1)
+            self.count(address, 1)
+
+    # busio.I2C interface used by adafruit_bus_device.I2CDevice
+    def try_lock(self) -> bool:
+        return True  # locked since start
+
+    def unlock(self):
+        pass
+
+    def scan(self) -> list:
+        return self.i2c.scan()
+
+    def readfrom_into(self, address: int, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        self.i2c.readfrom_into(address, buffer, start=start, end=end)
+        self.count(address, end - start)
+
+    def writeto(self, address: int, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        self.i2c.writeto(address, buffer, start=start, end=end)
+        self.count(address, end - start)
+
+    def writeto_then_readfrom(
+        self,
+        address: int,
+        buffer_out,
+        buffer_in,
+        *,
+        out_start=0,
+        out_end=None,
+        in_start=0,
+        in_end=None,
+    ):
+        out_end = len(buffer_out) if out_end is None else out_end
+        in_end = len(buffer_in) if in_end is None else in_end
+        self.i2c.writeto_then_readfrom(
+            address,
+            buffer_out,
+            buffer_in,
+            out_start=out_start,
+            out_end=out_end,
+            in_start=in_start,
+            in_end=in_end,
+        )
+        self.count(address, out_end - out_start + in_end - in_start)
+
+    def dump(self):
+        """Print transactions and bytes of every device"""
+        print(f"I2C {self.frequency} Hz")
+        for address in sorted(self.transactions):
+            print(
+                f"  0x{address:02X} {self.transactions[address]:8d} transactions"
+                f" {self.bytes[address]:8d} bytes"
+            )
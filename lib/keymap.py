@@ -0,0 +1,146 @@
+import struct
+from macropad import HIDType as hid, ButtonInputType as BiT, no_action, repeat
+
+KEYMAP_MAGIC = b"KMAP"
+KEYMAP_VERSION = 1
+# magic, version, layer count, rows, columns, encoders, turn actions per encoder, name count
+KEYMAP_HEADER = "<4sBBBBBBH"
+LAYER_ENTRY = "<12sI"  # layer name, file offset of the layer
+ENCODER_HEADER = "<BBBBBBxx"  # turn action count, button pin, (speed, multiplier) * 2
+ACTION_RECORD = "<BB6s"  # ActionType, argument, payload
+RECORD_SIZE = 8
+
+
+# Action type of a record in the compiled keymap
+class ActionType:
+    NONE = 0
+    MEDIA = 1  # payload is u16 consumer control code
+    KEY = 2  # argument is keycode count, payload is keycodes
+    CUSTOM = 3  # payload is u16 index of the function name
+    WHEEL = 4  # argument is signed mouse wheel step per detent, encoder only
+    LAYER = 5  # argument is LayerMode, payload is u8 layer index, button only
+
+
+def signed(byte: int) -> int:
+    return byte - 256 if byte > 127 else byte
+
+
+# Keymap compiled by keymap-compiler/compile_keymap.py. Only the header and the
+# names are read at start, a layer is read from the file when it's loaded.
+# CUSTOM actions are looked up by name in `functions`, encoder functions are
+# called with the number of detents like the encoder actions in config.py.
+class Keymap:
+    def __init__(self, path: str, functions: dict):
+        self.path = path
+        self.functions = functions
+        with open(path, "rb") as f:
+            header = f.read(struct.calcsize(KEYMAP_HEADER))
+            magic, version, layers, rows, columns, encoders, slots, names = struct.unpack(
+                KEYMAP_HEADER, header
+            )
+            if magic != KEYMAP_MAGIC or version != KEYMAP_VERSION:
+                raise ValueError(f"{path} is not a keymap version {KEYMAP_VERSION}")
+
+            self.rows = rows
+            self.columns = columns
+            self.num_encoders = encoders
+            self.turn_slots = slots
+            self.layer_names = []
+            self.offsets = []
+            entry_size = struct.calcsize(LAYER_ENTRY)
+            for _ in range(layers):
+                name, offset = struct.unpack(LAYER_ENTRY, f.read(entry_size))
+                self.layer_names.append(name.rstrip(b"\0").decode())
+                self.offsets.append(offset)
+
+            self.names = []
+            for _ in range(names):
+                length = f.read(1)[0]
+                self.names.append(f.read(length).decode())
+
+        self.encoder_size = struct.calcsize(ENCODER_HEADER) + (slots + 1) * RECORD_SIZE
+        self.layer_size = rows * columns * RECORD_SIZE + encoders * self.encoder_size
+
+    def find_layer(self, name: str) -> int:
+        return self.layer_names.index(name)
+
+    def function(self, payload: bytes) -> callable:
+        name = self.names[payload[0] | (payload[1] << 8)]
+        if name not in self.functions:
+            raise ValueError(f"Keymap function {name} is not defined")
+        return self.functions[name]
+
+    def button_action(self, record: memoryview) -> tuple:
+        """(ButtonInputType, keymap) like the KEYPADS entries in config.py"""
+        kind, argument, payload = struct.unpack(ACTION_RECORD, record)
+        if kind == ActionType.KEY:
+            return (BiT.KEY, list(payload[:argument]))
+        elif kind == ActionType.MEDIA:
+            return (BiT.MEDIA, payload[0] | (payload[1] << 8))
+        elif kind == ActionType.CUSTOM:
+            return (BiT.CUSTOM, self.function(payload))
+        elif kind == ActionType.LAYER:
+            return (BiT.LAYER, (argument, payload[0]))
+        return (BiT.CUSTOM, no_action)  # also mean transparent in layers.LayerStack
+
+    def turn_action(self, record: memoryview) -> callable:
+        """Encoder action called with number of detents"""
+        kind, argument, payload = struct.unpack(ACTION_RECORD, record)
+        report = hid.REPORT
+        if kind == ActionType.KEY:
+            keycodes = tuple(payload[:argument])
+            return repeat(lambda: report.send(*keycodes))
+        elif kind == ActionType.MEDIA:
+            code = payload[0] | (payload[1] << 8)
+            return repeat(lambda: report.send_consumer(code))
+        elif kind == ActionType.WHEEL:
+            step = signed(argument)
+            return lambda n: report.move(wheel=step * n)
+        elif kind == ActionType.CUSTOM:
+            return self.function(payload)
+        return lambda n: None
+
+    def load_layer(self, index: int) -> tuple[list, list]:
+        """Read one layer, return (ENCODERS, KEYPADS) shaped like config.input_map"""
+        with open(self.path, "rb") as f:
+            f.seek(self.offsets[index])
+            data = memoryview(f.read(self.layer_size))
+
+        keypads = []
+        offset = 0
+        for _ in range(self.rows):
+            row = []
+            for _ in range(self.columns):
+                row.append(self.button_action(data[offset : offset + RECORD_SIZE]))
+                offset += RECORD_SIZE
+            keypads.append(row)
+
+        encoders = []
+        header_size = struct.calcsize(ENCODER_HEADER)
+        for _ in range(self.num_encoders):
+            count, pin, speed1, multiplier1, speed2, multiplier2 = struct.unpack(
+                ENCODER_HEADER, data[offset : offset + header_size]
+            )
+            offset += header_size
+            actions = []
+            # Encoder with no turn action is transparent in layers.LayerStack
+            for slot in range(self.turn_slots):
+                if slot < count:
+                    actions.append(self.turn_action(data[offset : offset + RECORD_SIZE]))
+                offset += RECORD_SIZE
+            encoder = {
+                "actions": tuple(actions),
+                "button": {
+                    "pin": pin,
+                    "actions": self.button_action(data[offset : offset + RECORD_SIZE]),
+                },
+            }
+            offset += RECORD_SIZE
+            if speed1:
+                acceleration = ((speed1, multiplier1),)
+                if speed2:
+                    acceleration += ((speed2, multiplier2),)
+                encoder["acceleration"] = acceleration
+            encoders.append(encoder)
+
+        return encoders, keypads
@@ -0,0 +1,156 @@
+from macropad import ButtonInputType as BiT, compile_action, no_action
+
+
+def no_turn(count: int):
+    pass
+
+
+NO_ACTIONS = (no_action, no_action)  # (press, release) of key with no action in any layer
+NO_TURN = (no_turn, no_turn)
+
+
+# How a LAYER button switch its layer
+class LayerMode:
+    MOMENTARY = 1  # layer is on while the button is held
+    TOGGLE = 2  # every press turn the layer on or off
+    PROFILE = 3  # replace the base layer, e.g. one profile per application
+
+
+# Layers on top of the profile layer, a higher layer number win. Transparent actions
+# (no action in the keymap) fall through to the layer below. A layer is compiled
+# once, the first time it's turned on, when the active layers change the winning
+# layer of every key is resolved and its prebuilt actions are put into the existing
+# on_press/on_release lists of ButtonMatrix and ExpanderButtons and into
+# SplitRotaryEncoder, so a key event is still one list lookup.
+class LayerStack:
+    def __init__(
+        self,
+        layers: list,
+        matrix,
+        buttons,
+        encoders: list,
+        encoder_order: list,
+        profile: int = 0,
+        load_layer: callable = None,
+    ):
+        """`layers` is list of (ENCODERS, KEYPADS) like config.input_map, layer
+        index is its number. A None layer is read by load_layer(index) when it's
+        turned on, the profile layer must be given. encoders[i] use
+        ENCODERS[encoder_order[i] - 1] and buttons use ENCODERS order, same as main.py."""
+        self.matrix = matrix
+        self.buttons = buttons
+        self.encoders = encoders
+        self.encoder_order = encoder_order
+        self.num_layers = len(layers)
+        self.load_layer = load_layer
+
+        # Per layer (None until it's loaded), per key (press, release) or None
+        self.key_actions = [None] * self.num_layers
+        self.button_actions = [None] * self.num_layers  # same per encoder button
+        self.turn_actions = [None] * self.num_layers  # per encoder (actions, acceleration)
+        for layer, layer_map in enumerate(layers):
+            if layer_map is not None:
+                self.compile_layer(layer, layer_map)
+
+        self.held = bytearray(self.num_layers)  # momentary buttons holding each layer
+        self.toggled = bytearray(self.num_layers)
+        self.profile = profile  # base layer, always on
+        self.key_layer = bytearray(len(self.key_actions[profile]))  # resolved layer per key
+        self.button_layer = bytearray(len(self.button_actions[profile]))
+        self.turn_layer = bytearray(len(self.turn_actions[profile]))
+        self.resolve(force=True)
+
+    def compile_layer(self, layer: int, layer_map: tuple):
+        encoders_map, keypads = layer_map
+        self.key_actions[layer] = [
+            self.compile_button(action) for row in keypads for action in row
+        ]
+        self.button_actions[layer] = [
+            self.compile_button(e["button"]["actions"]) for e in encoders_map
+        ]
+        self.turn_actions[layer] = [
+            (e["actions"], e.get("acceleration")) if e["actions"] else None
+            for e in encoders_map
+        ]
+
+    def ensure_loaded(self, layer: int):
+        """Read and compile the layer on its first use, it stay compiled after"""
+        if self.key_actions[layer] is None:
+            self.compile_layer(layer, self.load_layer(layer))
+
+    def compile_button(self, action: tuple):
+        """(press, release) of the action, None when it's transparent"""
+        input_type, keymap = action
+        if input_type == BiT.LAYER:
+            mode, layer = keymap
+            if mode == LayerMode.MOMENTARY:
+                return (lambda: self.hold(layer)), (lambda: self.release(layer))
+            elif mode == LayerMode.TOGGLE:
+                return (lambda: self.toggle(layer)), no_action
+            return (lambda: self.set_profile(layer)), no_action
+        if input_type == BiT.CUSTOM and keymap is no_action:
+            return None
+        return compile_action(action)
+
+    def top_layer(self, table: list, index: int) -> int:
+        """Highest held or toggled layer that has an action for index, the profile
+        layer is always at the bottom no matter its number. Layers that are on are
+        always loaded."""
+        for layer in range(self.num_layers - 1, -1, -1):
+            if (
+                (self.held[layer] or self.toggled[layer])
+                and layer != self.profile
+                and table[layer][index] is not None
+            ):
+                return layer
+        return self.profile
+
+    def resolve(self, force: bool = False):
+        """Rebind every key, button and encoder whose winning layer changed"""
+        matrix = self.matrix
+        for key in range(len(self.key_layer)):
+            layer = self.top_layer(self.key_actions, key)
+            if force or layer != self.key_layer[key]:
+                self.key_layer[key] = layer
+                actions = self.key_actions[layer][key]
+                matrix.on_press[key], matrix.on_release[key] = actions or NO_ACTIONS
+
+        buttons = self.buttons
+        for button in range(len(self.button_layer)):
+            layer = self.top_layer(self.button_actions, button)
+            if force or layer != self.button_layer[button]:
+                self.button_layer[button] = layer
+                actions = self.button_actions[layer][button]
+                buttons.on_press[button], buttons.on_release[button] = actions or NO_ACTIONS
+
+        for i, encoder in enumerate(self.encoders):
+            index = self.encoder_order[i] - 1
+            layer = self.top_layer(self.turn_actions, index)
+            if force or layer != self.turn_layer[index]:
+                self.turn_layer[index] = layer
+                turn = self.turn_actions[layer][index]
+                if turn is None:
+                    encoder.set_actions(NO_TURN)
+                else:
+                    encoder.set_actions(*turn)
+
+    def hold(self, layer: int):
+        self.ensure_loaded(layer)
+        self.held[layer] += 1
+        self.resolve()
+
+    def release(self, layer: int):
+        if self.held[layer]:
+            self.held[layer] -= 1
+        self.resolve()
+
+    def toggle(self, layer: int):
+        self.ensure_loaded(layer)
+        self.toggled[layer] = not self.toggled[layer]
+        self.resolve()
+
+    def set_profile(self, layer: int):
+        if layer != self.profile:
+            self.ensure_loaded(layer)
+            self.profile = layer
+            self.resolve()
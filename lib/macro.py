@@ -0,0 +1,96 @@
+import time
+
+
+# Play key sequences and text through HIDReport a report at a time, from a scheduler
+# task, so typing a long string doesn't block scanning like KeyboardLayout.write.
+# A macro is compiled once into a tuple of steps: a chord (tuple of keycodes) is
+# pressed in one report and released in the next, an int is a pause in ms.
+class MacroPlayer:
+    def __init__(self, report, layout):
+        self.report = report  # hid_report.HIDReport
+        self.layout = layout  # KeyboardLayout used to turn text into keycodes
+        self.cache = {}
+        self.queue = []  # macros waiting to be played
+        self.steps = None  # macro that is playing now
+        self.step = 0  # next step in self.steps
+        self.chord = None  # chord pressed by the last step
+        self.wait_until = 0  # time.monotonic_ns() the pause ends
+
+    def compile(self, source) -> tuple:
+        """Steps of a text string, or of a sequence of keycode (int), chord (tuple or
+        list of keycodes), text (str) and pause in seconds (float). Same source is
+        compiled once."""
+        if isinstance(source, str):
+            key = source
+        else:
+            key = tuple(tuple(item) if isinstance(item, list) else item for item in source)
+        if key in self.cache:
+            return self.cache[key]
+
+        steps = []
+        for item in (key,) if isinstance(key, str) else key:
+            if isinstance(item, str):
+                for char in item:
+                    steps.append(tuple(self.layout.keycodes(char)))
+            elif isinstance(item, float):
+                steps.append(int(item * 1000))
+            elif isinstance(item, int):
+                steps.append((item,))
+            else:
+                steps.append(tuple(item))
+        steps = tuple(steps)
+        self.cache[key] = steps
+        return steps
+
+    @property
+    def playing(self) -> bool:
+        return bool(self.steps is not None or self.chord or self.wait_until or self.queue)
+
+    def play(self, steps: tuple):
+        """Play compiled macro after the ones already playing"""
+        self.queue.append(steps)
+
+    def cancel(self):
+        """Stop the macro that is playing and drop the queued ones"""
+        self.queue.clear()
+        self.steps = None
+        self.wait_until = 0
+        if self.chord is not None:
+            self.report.release_keys(self.chord)
+            self.chord = None
+
+    # Put this in scheduler, the task period is the delay between reports
+    def update(self):
+        if self.chord is not None:
+            if self.report.keyboard_changed:
+                return  # press is not sent yet
+            self.report.release_keys(self.chord)
+            self.chord = None
+            return
+
+        if self.wait_until:
+            if time.monotonic_ns() < self.wait_until:
+                return
+            self.wait_until = 0
+
+        if self.steps is None:
+            if not self.queue:
+                return
+            self.steps = self.queue.pop(0)
+            self.step = 0
+            if not self.steps:
+                self.steps = None
+                return
+
+        if self.report.keyboard_changed:
+            return  # release is not sent yet, same key again would be lost
+        step = self.steps[self.step]
+        self.step += 1
+        if self.step == len(self.steps):
+            self.steps = None
+
+        if isinstance(step, int):
+            self.wait_until = time.monotonic_ns() + step * 1_000_000
+        else:
+            self.report.press_keys(step)
+            self.chord = step
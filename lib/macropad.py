@@ -4,23 +4,33 @@ import digitalio
 import usb_hid
 import rotaryio
 import microcontroller
+import supervisor
 from digitalio import DigitalInOut, Direction, Pull
-from adafruit_hid.keyboard import Keyboard
 from adafruit_hid.mouse import Mouse
 from adafruit_hid.keycode import Keycode
 from adafruit_hid.consumer_control import ConsumerControl
 from adafruit_hid.consumer_control_code import ConsumerControlCode
 from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS
 from rp2pio_dualincrementalencoder import DualIncrementalEncoder
+from hid_report import HIDReport
+from macro import MacroPlayer
+from debounce import Debouncer
+from events import EventQueue, EventSource, ticks_diff
 
 
 # HID Type Tupple
 class HIDType:
-    KBD = Keyboard(usb_hid.devices)
     MOUSE = Mouse(usb_hid.devices)
     CC = ConsumerControl(usb_hid.devices)
     CC_CODE = ConsumerControlCode
-    LAYOUT = KeyboardLayoutUS(KBD)
+    # Only keycodes() is used, so no Keyboard is made. Keyboard() send a boot report
+    # at init, which the NKRO keyboard from boot.py refuse.
+    LAYOUT = KeyboardLayoutUS(None)
+    # Coalesce changes of one tick into one report per device, call REPORT.flush() every tick.
+    # Don't mix it with MOUSE/CC, they keep their own report state.
+    REPORT = HIDReport(usb_hid.devices)
+    # Key sequences and text typed through REPORT, call MACRO.update() from scheduler
+    MACRO = MacroPlayer(REPORT, LAYOUT)
 
 
 # Input Type Tupple
@@ -28,6 +38,45 @@ class ButtonInputType:
     MEDIA = 1  # this can be for volume, media player, brightness etc.
     KEY = 2  # Normal keyboard press & release
     CUSTOM = 3  # run lambda function
+    LAYER = 4  # switch layer, (LayerMode, layer index), handled by layers.LayerStack
+    MACRO = 5  # type text or key sequence, see macro.MacroPlayer.compile
+
+
+def no_action():
+    pass
+
+
+def compile_action(actions: tuple[ButtonInputType, callable]) -> tuple[callable, callable]:
+    """Turn (ButtonInputType, keymap) from config into prebound (press, release) callables,
+    so the type is checked once at startup instead of on every key event."""
+    input_type, keymap = actions
+    report = HIDType.REPORT
+
+    if input_type == ButtonInputType.KEY:
+        keycodes = tuple(keymap)
+        return (lambda: report.press_keys(keycodes)), (lambda: report.release_keys(keycodes))
+    elif input_type == ButtonInputType.MEDIA:
+        return (lambda: report.send_consumer(keymap)), no_action
+    elif input_type == ButtonInputType.CUSTOM:
+        return keymap, no_action
+    elif input_type == ButtonInputType.LAYER:
+        return no_action, no_action  # bound later by layers.LayerStack
+    elif input_type == ButtonInputType.MACRO:
+        player = HIDType.MACRO
+        steps = player.compile(keymap)
+        return (lambda: player.play(steps)), no_action
+    raise ValueError(f"Unknown button input type {input_type}")
+
+
+def compile_actions(actions: list) -> tuple[list[callable], list[callable]]:
+    """Compile list of button actions into index addressed press and release arrays"""
+    on_press = []
+    on_release = []
+    for action in actions:
+        press, release = compile_action(action)
+        on_press.append(press)
+        on_release.append(release)
+    return on_press, on_release
 
 
 class Button:
@@ -40,6 +89,8 @@ class Button:
         self.button = self.init_button(pin_button)
         self.button_state = False
         self.actions = actions  # (ButtonInputType.args , [Keycode.A, Keycode.B])
+        self.press, self.release = compile_action(actions)
+        self.pin_interupt = None
         if pin_interupt:
             self.pin_interupt = self.init_button(pin_interupt)
 
@@ -66,28 +117,13 @@ class Button:
         if is_pressed == None:
             is_pressed = self.button.value
 
-        input_type, keymap = self.actions
-
         if self.button_state == False and not is_pressed:  # Button pressed
-            try:
-                if input_type == ButtonInputType.KEY:
-                    HIDType.KBD.press(*keymap)
-                elif input_type == ButtonInputType.MEDIA:
-                    HIDType.CC.send(keymap)
-                elif input_type == ButtonInputType.CUSTOM:
-                    keymap()
-
-                # print("Button pressed")
-            except ValueError:  # deals with six-key limit
-                pass
+            self.press()
+            # print("Button pressed")
             self.button_state = True
 
         if self.button_state == True and is_pressed:  # Button released
-            try:
-                if input_type == ButtonInputType.KEY:
-                    HIDType.KBD.release(*keymap)
-            except ValueError:
-                pass
+            self.release()
             self.button_state = False
             # print("Button released")
 
@@ -95,13 +131,109 @@ class Button:
         pass
 
     def button_action_with_interupt(self):
+        # PCF8574 INT is open-drain and active low, it goes low on any input change.
+        # So while it stay high we don't need to touch the I2C bus at all.
+        if self.pin_interupt is not None and self.pin_interupt.value:
+            return
+
         try:
-            # if not self.pin_interupt.value:
             self.button_action()
         except OSError as e:
             print(e)
 
 
+def init_interupt_pin(pin: board.Pin):
+    """PCF8574 INT pin is open-drain, so it need pull-up on the pico side"""
+    interupt = DigitalInOut(pin)
+    interupt.direction = Direction.INPUT
+    interupt.pull = Pull.UP
+    return interupt
+
+
+# Buttons wired straight to PCF8574 pins (like rotary encoder buttons).
+# All of them read with single read_gpio per scan instead of one read per button.
+class ExpanderButtons:
+    def __init__(
+        self,
+        expander,
+        pins: list[int],
+        actions: list[tuple[ButtonInputType, callable]],
+        pin_interupt: board.Pin = None,
+        debouncer: Debouncer = None,
+        events: EventQueue = None,
+    ):
+        self.expander = expander
+        self.debouncer = debouncer
+        self.events = events  # push changes there instead of running the actions
+        self.pin_bits = pins
+        for pin in pins:
+            expander.get_pin(pin).switch_to_input(pull=digitalio.Pull.UP)
+        self.on_press, self.on_release = compile_actions(actions)
+        # Release action of every held button is the one bound when it was pressed,
+        # so on_press/on_release can be rebound (layers) while a button is held
+        self.releasing = list(self.on_release)
+
+        self.pin_interupt = None
+        if pin_interupt:
+            self.pin_interupt = init_interupt_pin(pin_interupt)
+
+        self.state = 0  # bitmask of pressed buttons, bit = index in pins
+        # A change didn't fit in the event queue, read the port again even if INT is high
+        self.retry = False
+
+    def read_state(self) -> int:
+        port = self.expander.read_gpio()  # reading the port also clear INT
+        state = 0
+        pin_bits = self.pin_bits
+        for i in range(len(pin_bits)):  # enumerate would allocate a tuple per pin
+            if not (port >> pin_bits[i]) & 1:  # pulled low = pressed
+                state |= 1 << i
+        return state
+
+    # Put this in while loop
+    def button_scanning(self):
+        # INT high mean nothing changed since the last port read
+        if (
+            self.pin_interupt is not None
+            and self.pin_interupt.value
+            and not self.retry
+            and (self.debouncer is None or self.debouncer.is_settled())
+        ):
+            return self.state
+
+        try:
+            state = self.read_state()
+        except OSError as e:
+            print(e)
+            return self.state
+
+        if self.debouncer is not None:
+            state = self.debouncer.update(state)
+
+        changed = state ^ self.state
+        self.retry = False
+        bit = 0
+        while changed:
+            if changed & 1:
+                pressed = (state >> bit) & 1
+                if self.events is None:
+                    self.handle_event(bit, pressed)
+                elif not self.events.push(EventSource.BUTTONS, bit, pressed):
+                    state ^= 1 << bit  # queue is full, found again on the next scan
+                    self.retry = True  # INT was cleared by the read, don't wait for it
+            changed >>= 1
+            bit += 1
+        self.state = state
+        return state
+
+    def handle_event(self, bit: int, pressed: int):
+        if pressed:
+            self.releasing[bit] = self.on_release[bit]
+            self.on_press[bit]()
+        else:
+            self.releasing[bit]()
+
+
 # Original Rotary Encoder
 class RotaryEncoder:
     def __init__(
@@ -140,60 +272,207 @@ class RotaryEncoder:
             self.last_position = current_position
 
 
+# Poll every DualIncrementalEncoder once per tick and share the result, so each
+# encoder pair is drained once instead of once for each of its halves. Positions
+# and deltas are lists updated in place, polling doesn't allocate.
+class EncoderBank:
+    def __init__(self, dual_encoders: list[DualIncrementalEncoder]):
+        self.dual_encoders = dual_encoders
+        self.positions = [0] * (len(dual_encoders) * 2)  # snapshot of every encoder position
+        self.latest = list(self.positions)
+        self.read_positions(self.positions)
+        self.deltas = [0] * len(self.positions)  # change of every position since the previous poll
+        self.moved = False  # any delta is not 0
+
+    def read_positions(self, positions: list):
+        index = 0
+        for dual_encoder in self.dual_encoders:
+            dual_encoder.positions_into(positions, index)
+            index += 2
+
+    # Call this once per tick, before encoder_action of each SplitRotaryEncoder
+    def poll(self) -> list:
+        latest = self.latest
+        positions = self.positions
+        deltas = self.deltas
+        self.read_positions(latest)
+        moved = False
+        for i in range(len(latest)):
+            delta = latest[i] - positions[i]
+            deltas[i] = delta
+            if delta:
+                positions[i] = latest[i]
+                moved = True
+        self.moved = moved
+        return positions
+
+
+def repeat(action: callable) -> callable:
+    """Wrap single step action (like KBD.send shortcut) so it run once for every
+    detent when the encoder action is called with a count."""
+
+    def repeated(count: int):
+        for _ in range(count):
+            action()
+
+    return repeated
+
+
 class SplitRotaryEncoder:
     def __init__(
         self,
         name: str,
-        encoder: rotaryio.IncrementalEncoder | DualIncrementalEncoder,
+        encoder: DualIncrementalEncoder | EncoderBank,
         index: int,
         actions: callable,
+        acceleration: tuple[tuple[float, int], ...] = None,
+        events: EventQueue = None,
     ):
         self.name = name
-        self.encoder = encoder  # use DualIncrementalEncoder
-        self.index = index  # since using DualIncrementalEncoder require 4 pins and it split into 2 positions = (0,0)
+        self.events = events  # push detents there, they are turned by turn()
+        self.encoder = encoder  # use DualIncrementalEncoder or EncoderBank
+        # Index in encoder.positions, DualIncrementalEncoder split into 2 positions = (0,0)
+        # and EncoderBank have position of every encoder
+        self.index = index
         self.last_position = encoder.positions[index]
+        # Position the actions were run for, with the event queue it's behind
+        # last_position until the queued turns are dispatched
+        self.turned_position = self.last_position
+        # Every action is called with number of detents moved since the last call,
+        # e.g. lambda n: hid.MOUSE.move(wheel=n)
         self.actions = actions
         self.num_actions = len(actions)
+        # ((detents per second, multiplier), ...) sorted by speed, the detents count
+        # is multiplied when the knob is turned at least that fast
+        self.acceleration = acceleration
+        self.last_time = supervisor.ticks_ms()
+
+    def set_actions(self, actions: tuple, acceleration: tuple = None):
+        """Rebind the encoder to another prebuilt actions tuple (layer switch)"""
+        self.actions = actions
+        self.num_actions = len(actions)
+        self.acceleration = acceleration
+
+    def accelerate(self, detents: int, now: int = None) -> int:
+        """`now` is supervisor.ticks_ms() of the turn, when it was queued it's the
+        push time so the wait in the queue doesn't slow down the knob"""
+        if now is None:
+            now = supervisor.ticks_ms()
+        elapsed = ticks_diff(now, self.last_time)
+        self.last_time = now
+        if not self.acceleration or elapsed < 0:  # negative: idle for days
+            return detents
+
+        # detents / elapsed seconds < min_speed, in small ints without float division
+        multiplier = 1
+        for min_speed, factor in self.acceleration:
+            if detents * 1000 < min_speed * elapsed:
+                break
+            multiplier = factor
+        return detents * multiplier
 
     def encoder_action(self):
         current_position = self.encoder.positions[self.index]
-        index = current_position % self.num_actions
-
-        if current_position != self.last_position:
-            # Clockwise action
-            if current_position > self.last_position:
-                # print(f"{self.name}: Clockwise")
-                if self.num_actions > 2:
-                    self.actions[index]()
-                else:
-                    self.actions[0]()
+        delta = current_position - self.last_position
 
-            # Counterclokwise action
-            else:
-                # print(f"{self.name}: Counterclockwise")
-                if self.num_actions > 2:
-                    self.actions[index]()
-                else:
-                    self.actions[1]()
+        if not delta:
+            return False
 
-            self.last_position = current_position
+        if self.events is not None:
+            delta = max(-127, min(127, delta))
+            if not self.events.push(EventSource.ENCODER, self.index, delta):
+                return False  # queue is full, same delta is found on the next poll
+            self.last_position += delta
             return True
 
+        self.last_position = current_position
+        self.turn(delta)
+        return True
+
+    def turn(self, delta: int, now: int = None):
+        """Run the action for delta detents, turned at supervisor.ticks_ms() now"""
+        self.turned_position += delta
+        # Action for every position, only the final position matter
+        if self.num_actions > 2:
+            self.actions[self.turned_position % self.num_actions](1)
+
+        # Clockwise action
+        elif delta > 0:
+            # print(f"{self.name}: Clockwise {delta}")
+            self.actions[0](self.accelerate(delta, now))
+
+        # Counterclokwise action
+        else:
+            # print(f"{self.name}: Counterclockwise {-delta}")
+            self.actions[1](self.accelerate(-delta, now))
+
 
 # This button matrix used PCF8574 for columns.
 # Columns is the input and rows the output
 class ButtonMatrix:
     def __init__(
-        self, rows: list[board.Pin], columns: list[int], actions: callable, expander
+        self,
+        rows: list[board.Pin],
+        columns: list[int],
+        actions: callable,
+        expander,
+        bulk_read: bool = True,
+        pin_interupt: board.Pin = None,
+        settle: float = None,
+        debouncer: Debouncer = None,
+        events: EventQueue = None,
     ):
         self.actions = actions
         self.expander = expander
+        self.debouncer = debouncer
+        self.events = events  # push changes there instead of running the actions
+        self.bulk_read = bulk_read  # read whole expander port once per row
+        self.column_bits = columns  # expander pin number of each column
+        self.column_mask = 0
+        for col_bit in columns:
+            self.column_mask |= 1 << col_bit
         self.rows = self.init_matrix_by_gpio(rows)
         self.columns = self.init_matrix_by_expander(columns)
-        self.buttons = self.init_button_matrix()
-
-    def button_name(self, r, c):
-        return f"R{r}C{c}"  # output: R0C0
+        # Press and release callables addressed by bit index (row * num_columns + col)
+        self.on_press, self.on_release = self.init_button_matrix()
+        self.releasing = list(self.on_release)  # release bound when the key was pressed
+        self.state = 0  # bitmask of pressed keys, bit = row * num_columns + col
+        self.retry = False  # a change didn't fit in the event queue, scan even when idle
+
+        # Bulk scan is pipelined: a row is driven and sampled on a later call, after
+        # settle seconds. With settle None the row is sampled on the next call.
+        self.settle = None if settle is None else int(settle * 1_000_000_000)
+        self.scan_row = -1  # row that is driven now, -1 when no scan in progress
+        self.row_driven_at = 0
+        self.row_fresh = False  # row was driven in this call
+        self.scan_state = 0  # keys found so far in this scan
+        self.scanned = 0  # keys of the last complete scan
+
+        # With interupt pin all rows are kept active (low) while idle, so any key press
+        # pull its column low and the expander assert INT. Only bulk scan support it.
+        self.pin_interupt = None
+        self.idle_port = self.column_mask
+        if pin_interupt and bulk_read:
+            self.pin_interupt = init_interupt_pin(pin_interupt)
+            self.arm_interupt()
+
+    def arm_interupt(self):
+        """Activate all rows and read the port once, so INT is cleared and
+        the next key press will assert it again."""
+        for row in self.rows:
+            row.value = False
+        self.idle_port = self.expander.read_gpio()
+
+    def is_idle(self) -> bool:
+        """True when no key is held and the INT pin say nothing changed since
+        the last read, in that case scanning can skip the I2C bus entirely."""
+        return (
+            not self.state
+            and not self.retry
+            and self.pin_interupt.value
+            and self.idle_port & self.column_mask == self.column_mask
+            and (self.debouncer is None or self.debouncer.is_settled())
+        )
 
     # This is input
     def init_matrix_by_expander(self, pin_list: list[int]):
@@ -215,26 +494,125 @@ class ButtonMatrix:
         return pins
 
     def init_button_matrix(self):
-        buttons = {}
+        actions = []
         for r in range(len(self.rows)):
             for c in range(len(self.columns)):
-                label = f"R{r}C{c}"  # output: R0C0
-                buttons[label] = Button(pin_button=label, actions=self.actions[r][c])
-
-        return buttons
+                actions.append(self.actions[r][c])
+
+        return compile_actions(actions)
+
+    def drive_row(self, row_index: int):
+        self.rows[row_index].value = False  # activate the row
+        if self.settle is not None:
+            self.row_driven_at = time.monotonic_ns()
+        self.row_fresh = True
+        self.scan_row = row_index
+
+    def is_settled(self) -> bool:
+        if self.settle is None:
+            return not self.row_fresh
+        return time.monotonic_ns() - self.row_driven_at >= self.settle
+
+    def scan_step(self) -> bool:
+        """Advance the pipelined scan without blocking, return True when every row
+        was sampled and self.scanned hold the pressed keys as a bitmask.
+
+        Every row costs a single PCF8574.read_gpio transaction, all columns
+        are decoded from that one port byte. Only the row that ends and the row
+        that starts are written.
+        """
+        self.row_fresh = False
+
+        if self.scan_row < 0:
+            if self.pin_interupt is not None:
+                for row in self.rows:
+                    row.value = True  # leave idle mode, deactivate all rows
+            self.scan_state = 0
+            self.drive_row(0)
+
+        while self.is_settled():
+            row_index = self.scan_row
+            port = self.expander.read_gpio()
+            self.rows[row_index].value = True  # deactivate it again, other rows are already high
+
+            bit = row_index * len(self.column_bits)
+            for col_bit in self.column_bits:
+                if not (port >> col_bit) & 1:  # column pulled low = pressed
+                    self.scan_state |= 1 << bit
+                bit += 1
+
+            if row_index + 1 < len(self.rows):
+                self.drive_row(row_index + 1)
+                continue
+
+            self.scanned = self.scan_state
+            if self.pin_interupt is not None:
+                self.scan_row = -1
+                self.arm_interupt()
+            else:
+                # Start the next scan now, so row 0 settle until the next call and a
+                # scan take one call per row
+                self.scan_state = 0
+                self.drive_row(0)
+            return True
 
-    # Put this in while loop
-    def matrix_scanning(self):
-        for row_idx, row in enumerate(self.rows):
+        return False
+
+    def dispatch_changes(self, state: int):
+        """Run button actions (or queue them) only for keys whose bit changed
+        since last scan."""
+        changed = state ^ self.state
+        self.retry = False
+        bit = 0
+
+        while changed:
+            if changed & 1:
+                pressed = (state >> bit) & 1
+                if self.events is None:
+                    self.handle_event(bit, pressed)
+                elif not self.events.push(EventSource.MATRIX, bit, pressed):
+                    state ^= 1 << bit  # queue is full, found again on the next scan
+                    self.retry = True
+            changed >>= 1
+            bit += 1
+        self.state = state
+
+    def handle_event(self, bit: int, pressed: int):
+        if pressed:
+            self.releasing[bit] = self.on_release[bit]
+            self.on_press[bit]()
+        else:
+            self.releasing[bit]()
+
+    def read_state_by_pin(self) -> int:
+        """Blocking scan of every row (1 ms settle each) where every column is read by
+        its own I2C transaction, for expanders that can't use the bulk scan_step"""
+        state = 0
+        bit = 0
+        for row in self.rows:
             for r in self.rows:
                 r.value = True  # deactivate all rows
             row.value = False  # activate current row
             time.sleep(0.001)
 
-            for col_idx, col in enumerate(self.columns):
-                label = f"R{row_idx}C{col_idx}"
-                is_pressed = not col.value  # return False
-                button = self.buttons[label]
+            for col in self.columns:
+                if not col.value:  # column pulled low = pressed
+                    state |= 1 << bit
+                bit += 1
+        return state
+
+    # Put this in while loop
+    def matrix_scanning(self):
+        if not self.bulk_read:
+            state = self.read_state_by_pin()
+        elif self.scan_row < 0 and self.pin_interupt is not None and self.is_idle():
+            return self.state
+        elif self.scan_step():
+            state = self.scanned
+        else:
+            return self.state  # scan still in progress
 
-                if is_pressed != button.button_state:
-                    button.button_action(is_pressed=not is_pressed)
+        if self.debouncer is not None:
+            state = self.debouncer.update(state)
+        self.dispatch_changes(state)
+        return state
@@ -0,0 +1,57 @@
+import gc
+import time
+
+
+# Run gc.collect() between inputs, so CircuitPython doesn't have to collect in the
+# middle of a key press when the heap run out. Collect when free RAM is below
+# low_water, or max_interval seconds passed since the last collection.
+class GCPolicy:
+    def __init__(self, low_water: int = 32_000, max_interval: float = 5):
+        self.low_water = low_water
+        self.max_interval = int(max_interval * 1_000_000_000)
+        self.collections = 0
+        self.collected_at = time.monotonic_ns()
+        gc.collect()  # start with a clean heap after all the setup
+
+    # Put this in scheduler, with a busy check like main.input_busy
+    def collect_if_idle(self, busy: bool) -> bool:
+        if busy:
+            return False
+        now = time.monotonic_ns()
+        if gc.mem_free() >= self.low_water and now - self.collected_at < self.max_interval:
+            return False
+        gc.collect()
+        self.collections += 1
+        self.collected_at = time.monotonic_ns()
+        return True
+
+
+# How AllocCheck report a task that allocated
+class AllocCheckMode:
+    LOG = 1  # print the task name and the bytes
+    ASSERT = 2  # raise AssertionError, for testing
+
+
+# Check that input tasks don't allocate, by comparing gc.mem_alloc() before and after
+# every call. Like profiler.Profiler the callback is not wrapped when it's disabled.
+class AllocCheck:
+    def __init__(self, mode: int = None):
+        self.mode = mode
+        self.allocations = 0  # calls that allocated
+
+    def wrap(self, name: str, callback: callable) -> callable:
+        if self.mode is None:
+            return callback
+        mem_alloc = gc.mem_alloc
+
+        def checked():
+            before = mem_alloc()
+            callback()
+            allocated = mem_alloc() - before
+            if allocated > 0:  # negative when gc collected in the call
+                self.allocations += 1
+                if self.mode == AllocCheckMode.ASSERT:
+                    raise AssertionError(f"{name} allocated {allocated} bytes")
+                print(f"{name} allocated {allocated} bytes")
+
+        return checked
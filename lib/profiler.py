@@ -0,0 +1,128 @@
+import time
+from array import array
+
+HISTOGRAM_BUCKETS = 48  # 2 buckets per power of 2, up to about 12 seconds in microseconds
+
+
+def bucket(us: int) -> int:
+    """Bucket index, 0-3 are exact, then 2 buckets for every power of 2"""
+    if us < 4:
+        return us
+    bits = 2
+    while us >= 8:
+        us >>= 1
+        bits += 1
+    index = bits * 2 + ((us >> 1) & 1)  # us is 4-7 now, bit 1 is the half
+    return index if index < HISTOGRAM_BUCKETS else HISTOGRAM_BUCKETS - 1
+
+
+def bucket_limit(index: int) -> int:
+    """Biggest value in microseconds that go to the bucket"""
+    if index < 4:
+        return index
+    shift = index // 2 - 2
+    return ((4 + (index & 1) * 2) << shift) + (2 << shift) - 1
+
+
+# Durations of one stage in fixed buckets, adding a value never allocate a new list
+class Histogram:
+    def __init__(self, name: str):
+        self.name = name
+        self.buckets = array("L", [0] * HISTOGRAM_BUCKETS)
+        self.count = 0
+        self.max = 0  # in microseconds
+
+    def add(self, ns: int):
+        us = ns // 1000
+        self.count += 1
+        if us > self.max:
+            self.max = us
+        self.buckets[bucket(us)] += 1
+
+    def percentile(self, fraction: float) -> int:
+        """Upper bound in microseconds of the value at fraction (0.5 for p50)"""
+        target = self.count * fraction
+        total = 0
+        for index in range(HISTOGRAM_BUCKETS):
+            total += self.buckets[index]
+            if total >= target and total:
+                return min(bucket_limit(index), self.max)
+        return self.max
+
+    def reset(self):
+        for index in range(HISTOGRAM_BUCKETS):
+            self.buckets[index] = 0
+        self.count = 0
+        self.max = 0
+
+
+# Time every scheduler task callback. When it's disabled the callbacks aren't
+# wrapped at all, so it cost nothing and can stay in the firmware.
+class Profiler:
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.stages = []
+        self.reports = []  # more functions that print stats, called after dump
+        self.started = time.monotonic_ns()
+        self.dumped = self.started
+
+    def wrap(self, name: str, callback: callable) -> callable:
+        """Callback that also record its duration in the `name` histogram"""
+        if not self.enabled:
+            return callback
+        histogram = Histogram(name)
+        self.stages.append(histogram)
+        monotonic_ns = time.monotonic_ns
+
+        def timed():
+            start = monotonic_ns()
+            callback()
+            histogram.add(monotonic_ns() - start)
+
+        return timed
+
+    def histogram(self, name: str):
+        """Histogram printed with the stages for durations measured elsewhere,
+        None when it's disabled"""
+        if not self.enabled:
+            return None
+        histogram = Histogram(name)
+        self.stages.append(histogram)
+        return histogram
+
+    def reset(self):
+        for histogram in self.stages:
+            histogram.reset()
+        self.started = time.monotonic_ns()
+
+    def dump(self):
+        """Print runs per second, p50, p99 and max duration of every stage"""
+        elapsed = (time.monotonic_ns() - self.started) / 1e9 or 1
+        runs = 0
+        print("stage          Hz     p50 us   p99 us   max us")
+        for stage in self.stages:
+            runs += stage.count
+            print(
+                f"{stage.name:<10} {stage.count / elapsed:7.1f} {stage.percentile(0.5):8d}"
+                f" {stage.percentile(0.99):8d} {stage.max:8d}"
+            )
+        print(f"loop       {runs / elapsed:7.1f} task runs per second")
+        for report in self.reports:
+            report()
+
+    # Put this in scheduler
+    def poll(self, serial, dump_every: float = None):
+        """Print the stages every `dump_every` seconds, and on console commands:
+        "p" print the stages, "r" reset them"""
+        if dump_every is not None:
+            now = time.monotonic_ns()
+            if now - self.dumped >= dump_every * 1e9:
+                self.dumped = now
+                self.dump()
+        if serial is None or not serial.in_waiting:
+            return
+        command = serial.read(1)
+        if command == b"p":
+            self.dump()
+        elif command == b"r":
+            self.reset()
@@ -0,0 +1,82 @@
+RECORD_MAGIC = 0xA5
+RECORD_HEADER = 4  # magic, sequence (u16 little endian), payload length
+
+
+# Small state saved as a ring of fixed size records in microcontroller.nvm (or any
+# bytearray like object). Every save go to the next slot instead of overwriting the
+# same bytes, so on byte writable NVM the writes are spread over the whole range.
+# On RP2040 nvm is one flash sector and every write rewrite the whole sector, so
+# rotation doesn't spread wear there, only skipping unchanged saves does.
+# At start only the slot headers are compared, the newest record is checksummed.
+class RecordLog:
+    def __init__(self, nvm, start: int, length: int, payload_size: int):
+        self.nvm = nvm
+        self.start = start
+        self.record_size = RECORD_HEADER + payload_size + 1  # + checksum
+        self.slots = length // self.record_size
+        if self.slots < 2:
+            raise ValueError("NVM range is too small for the record log")
+        self.slot = -1  # slot of the newest record
+        self.sequence = 0
+        self.buffer = bytearray(self.record_size)
+        self.find_newest()
+
+    def offset(self, slot: int) -> int:
+        return self.start + slot * self.record_size
+
+    def is_valid(self, slot: int) -> bool:
+        offset = self.offset(slot)
+        record = self.nvm[offset : offset + self.record_size]
+        if record[0] != RECORD_MAGIC or record[3] != self.record_size - RECORD_HEADER - 1:
+            return False
+        return sum(record[:-1]) & 0xFF == record[-1]
+
+    def find_newest(self):
+        """Read every slot header, sequence numbers wrap around at 65536. Only the
+        newest is checksummed, when it's bad (torn write) the next newest is used."""
+        payload_size = self.record_size - RECORD_HEADER - 1
+        bad = 0  # bitmask of slots that failed the checksum
+        while True:
+            newest = -1
+            newest_sequence = 0
+            for slot in range(self.slots):
+                if (bad >> slot) & 1:
+                    continue
+                offset = self.offset(slot)
+                header = self.nvm[offset : offset + RECORD_HEADER]
+                if header[0] != RECORD_MAGIC or header[3] != payload_size:
+                    continue
+                sequence = header[1] | (header[2] << 8)
+                if newest < 0 or (sequence - newest_sequence) & 0xFFFF < 0x8000:
+                    newest = slot
+                    newest_sequence = sequence
+            if newest < 0 or self.is_valid(newest):
+                self.slot = newest
+                self.sequence = newest_sequence
+                return
+            bad |= 1 << newest
+
+    def load(self):
+        """Payload of the newest record, None when nothing was saved yet"""
+        if self.slot < 0:
+            return None
+        offset = self.offset(self.slot) + RECORD_HEADER
+        return self.nvm[offset : offset + self.record_size - RECORD_HEADER - 1]
+
+    def save(self, payload):
+        """Write payload to the next slot, skipped when it's the same as the newest"""
+        if self.load() == bytes(payload):
+            return False
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        self.slot = (self.slot + 1) % self.slots
+
+        record = self.buffer
+        record[0] = RECORD_MAGIC
+        record[1] = self.sequence & 0xFF
+        record[2] = self.sequence >> 8
+        record[3] = len(payload)
+        record[RECORD_HEADER:-1] = payload
+        record[-1] = sum(record[:-1]) & 0xFF
+        offset = self.offset(self.slot)
+        self.nvm[offset : offset + self.record_size] = record  # one NVM write
+        return True
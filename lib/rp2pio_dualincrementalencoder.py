@@ -16,6 +16,23 @@ import rp2pio
 import array
 import digitalio
 
+
+def _build_pair_look_up_table(single):
+    """Combine single encoder table into one table for both encoders, index is
+    (previous 4 bit pin state << 4) | new 4 bit pin state.
+    Each entry hold 2 bit step code per encoder, bits 0-1 for encoder 0 and bits 2-3 for encoder 1:
+    0 = no move, 1 = +1, 2 = -1, 3 = one state was skipped, count 2 in the last direction
+    """
+    codes = {0: 0, 1: 1, -1: 2, 2: 3}
+    table = bytearray(256)
+    for previous in range(16):
+        for state in range(16):
+            code0 = codes[single[((previous & 3) << 2) | (state & 3)]]
+            code1 = codes[single[(previous & 0b1100) | (state >> 2 & 3)]]
+            table[(previous << 4) | state] = code0 | (code1 << 2)
+    return table
+
+
 class DualIncrementalEncoder:
     _state_look_up_table = array.array(
         "b",
@@ -75,6 +92,13 @@ class DualIncrementalEncoder:
 
     _sm_init = adafruit_pioasm.assemble("set y 31")
 
+    # RX FIFO depth of the state machine, when it's full the state machine stall
+    # and every transition until the next read is lost
+    _fifo_depth = 4
+
+    # Combined look up table for both encoders, see _build_pair_look_up_table
+    _pair_look_up_table = _build_pair_look_up_table(_state_look_up_table)
+
     def __init__(self, pin_a, pin_b, pin_c, pin_d):
         # pins_are_sequenctial only takes two pins at a time
         if not rp2pio.pins_are_sequential([pin_a, pin_b]):
@@ -94,47 +118,99 @@ class DualIncrementalEncoder:
             in_shift_right=False,
         )
 
-        self._counter0 = 0
-        self._counter1 = 0
-        self._direction0 = 0
-        self._direction1 = 0
-        self._lut0_index = 0
-        self._lut1_index = 0
-        self._buffer = bytearray(1)
-
-    def _update_state_machine(self, state):
-        lut0_index = self._lut0_index | (state & 3)
-        lut1_index = self._lut1_index | (state>>2 & 3)
-        lut0 = self._state_look_up_table[lut0_index]
-        lut1 = self._state_look_up_table[lut1_index]
-        #print(f"\t state:{state:08b} lut0:{lut0_index}/{lut0} lut1:{lut1_index}/{lut1}")
-        self._counter0 += lut0
-        self._counter1 += lut1
-        if lut0:
-            self._direction0 = 1 if (lut0 > 0) else 0
-        if lut1:
-            self._direction1 = 1 if (lut1 > 0) else 0
-        self._lut0_index = ((lut0_index << 2) & 0b1100) | (self._direction0 << 4)
-        self._lut1_index = ((lut1_index << 2) & 0b1100) | (self._direction1 << 4)
+        # Encoders rest at pin state 11 with pull-ups, start half way (2 quarter counts)
+        # into the detent so position change in the middle between two detents
+        self._counter0 = 2
+        self._counter1 = 2
+        self._direction0 = 1  # +1 or -1, used when a state was skipped
+        self._direction1 = 1
+        self._state = 0b1111  # last 4 bit pin state of both encoders
+        self._buffer = bytearray(8)  # big enough for joined FIFO too
+        self.lost_steps = 0  # skipped states, counted by guessing the direction
+        self.overflows = 0  # times FIFO was full when read, transitions were lost
+
+    def _decode(self, count):
+        """Decode `count` pin states from the buffer for both encoders at once"""
+        table = self._pair_look_up_table
+        buffer = self._buffer
+        previous = self._state
+        counter0 = self._counter0
+        counter1 = self._counter1
+        direction0 = self._direction0
+        direction1 = self._direction1
+        lost = 0
+
+        for i in range(count):
+            state = buffer[i]
+            code = table[(previous << 4) | state]
+            previous = state
+            if not code:
+                continue
+
+            step = code & 3
+            if step == 1:
+                counter0 += 1
+                direction0 = 1
+            elif step == 2:
+                counter0 -= 1
+                direction0 = -1
+            elif step == 3:
+                counter0 += direction0 << 1
+                lost += 1
+
+            step = code >> 2
+            if step == 1:
+                counter1 += 1
+                direction1 = 1
+            elif step == 2:
+                counter1 -= 1
+                direction1 = -1
+            elif step == 3:
+                counter1 += direction1 << 1
+                lost += 1
+
+        self._state = previous
+        self._counter0 = counter0
+        self._counter1 = counter1
+        self._direction0 = direction0
+        self._direction1 = direction1
+        self.lost_steps += lost
 
     def deinit(self):
         self._sm.deinit()
-        
+
+    def _drain(self):
+        """Decode every pin state waiting in the FIFO"""
+        sm = self._sm
+        waiting = sm.in_waiting
+        while waiting:
+            if waiting >= self._fifo_depth:
+                self.overflows += 1
+            waiting = min(waiting, len(self._buffer))
+            sm.readinto(self._buffer, end=waiting)
+            self._decode(waiting)
+            waiting = sm.in_waiting
+
     def get_positions(self):
         """ returns a tuple containing both encoder positions """
-        while self._sm.in_waiting:
-            self._sm.readinto(self._buffer)
-            self._update_state_machine(self._buffer[0])
-            # turn quarter_counts into position counts
+        self._drain()
+        # turn quarter_counts into position counts
         return (self._counter0 // 4, self._counter1 // 4)
 
+    def positions_into(self, values, index):
+        """ same as get_positions but write them to values[index] and
+        values[index + 1], so polling doesn't create a tuple """
+        self._drain()
+        values[index] = self._counter0 // 4
+        values[index + 1] = self._counter1 // 4
+
     # note this fails sometimes because loosing quarter counts
     def set_positions(self, vals):
         val0,val1 = vals
         if val0 is not None:
-            self._counter0 = val0*4
+            self._counter0 = val0*4 + 2  # middle of the detent, same as at start
         if val1 is not None:
-            self._counter1 = val1*4
+            self._counter1 = val1*4 + 2
 
     positions = property(get_positions, set_positions)
         
@@ -0,0 +1,73 @@
+import asyncio
+import supervisor
+from events import TICKS_HALF, TICKS_MASK, ticks_add, ticks_diff
+
+try:
+    from asyncio import sleep_ms
+except ImportError:  # CPython asyncio (simulator) only has sleep in seconds
+
+    def sleep_ms(ms: int):
+        return asyncio.sleep(ms / 1000)
+
+
+# One periodic job of the scheduler
+class Task:
+    def __init__(self, name: str, callback: callable, period: float, priority: int):
+        self.name = name
+        self.callback = callback
+        self.period = max(1, int(period * 1000 + 0.5))  # in milliseconds
+        self.priority = priority  # lower number is more important
+        self.next_run = supervisor.ticks_ms()  # due right away
+
+
+# Cooperative scheduler on top of asyncio, every subsystem (encoders, buttons,
+# matrix, display...) run as its own task with its own period.
+class Scheduler:
+    def __init__(self, profiler=None):
+        self.tasks = []
+        self.running = False
+        self.profiler = profiler  # profiler.Profiler that time every task
+
+    def add(self, name: str, callback: callable, period: float, priority: int = 0):
+        """Add callback that will be called every period (in seconds, rounded to ms).
+        Priority 0 is the most important, before a task run it will let every
+        more important task that already due to run first.
+        """
+        if self.profiler is not None:
+            callback = self.profiler.wrap(name, callback)
+        task = Task(name, callback, period, priority)
+        self.tasks.append(task)
+        self.tasks.sort(key=lambda t: t.priority)
+        return task
+
+    def has_due_task(self, priority: int, now: int) -> bool:
+        """Check if there's more important task waiting to run"""
+        for task in self.tasks:
+            if task.priority >= priority:
+                return False  # tasks is sorted, no need to check the rest
+            # ticks_diff(now, task.next_run) >= 0, inlined because it run on every pass
+            if (now - task.next_run) & TICKS_MASK < TICKS_HALF:
+                return True
+        return False
+
+    # Timing use supervisor.ticks_ms() small ints, time.monotonic_ns() long ints and
+    # a float delay would be allocated on every run
+    async def run_task(self, task: Task):
+        ticks_ms = supervisor.ticks_ms
+        while self.running:
+            while self.has_due_task(task.priority, ticks_ms()):
+                await sleep_ms(0)
+
+            task.next_run = ticks_add(ticks_ms(), task.period)
+            task.callback()
+
+            await sleep_ms(max(0, ticks_diff(task.next_run, ticks_ms())))
+
+    async def run(self):
+        self.running = True
+        # Create the most important task first so it also run first in each round
+        jobs = [asyncio.create_task(self.run_task(task)) for task in self.tasks]
+        await asyncio.gather(*jobs)
+
+    def stop(self):
+        self.running = False
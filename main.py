@@ -1,15 +1,27 @@
-import time
 import board
-import busio
+import asyncio
+import usb_cdc
+import microcontroller
 import display
 import config
 from deej import Deej
+from record_log import RecordLog
+from scheduler import Scheduler
+from i2c_bus import I2CBus
+from memory import GCPolicy, AllocCheck, AllocCheckMode
+from events import EventQueue, EventSource
+from profiler import Profiler
+from debounce import Debouncer, DebounceType
+from keymap import Keymap
+from layers import LayerStack
 from macropad import (
     HIDType as hid,
     ButtonInputType as BiT,
-    Button,
+    ExpanderButtons,
+    EncoderBank,
     SplitRotaryEncoder,
     ButtonMatrix,
+    repeat,
 )
 from adafruit_pcf8574 import PCF8574
 from adafruit_hid.keycode import Keycode as key
@@ -17,7 +29,27 @@ from rp2pio_dualincrementalencoder import DualIncrementalEncoder
 from adafruit_hid.consumer_control_code import ConsumerControlCode as cc_code
 
 
-DEEJ = Deej(config.DEEJ_PROGRAMS)
+def init_deej_serial():
+    serial = usb_cdc.data  # None when it's not enabled in boot.py
+    if serial is not None:
+        serial.write_timeout = 0  # drop volumes instead of blocking when host don't read
+        serial.timeout = 0  # read only what the host already sent
+    return serial
+
+
+def init_deej_store():
+    if config.DEEJ_NVM_RANGE is None or microcontroller.nvm is None:
+        return None
+    start, length = config.DEEJ_NVM_RANGE
+    return RecordLog(microcontroller.nvm, start, length, 1 + len(config.DEEJ_PROGRAMS))
+
+
+DEEJ = Deej(
+    config.DEEJ_PROGRAMS,
+    serial=init_deej_serial(),
+    binary=config.DEEJ_BINARY,
+    store=init_deej_store(),
+)
 
 SCREEN = display.DisplayScreen(
     pin_clock=config.DISPLAY_PINS["CLOCK"],
@@ -27,21 +59,34 @@ SCREEN = display.DisplayScreen(
     pin_reset=config.DISPLAY_PINS["RESET"],
     pin_bl=config.DISPLAY_PINS["BL"],
     rotation=config.DISPLAY_PINS["ROTATION"],
+    max_fps=config.DISPLAY_MAX_FPS,
+    duty=config.DISPLAY_DUTY,
 )
 
-ENCODERS, KEYPADS = config.input_map(SCREEN, DEEJ, BiT, key, hid, cc_code)
+if config.KEYMAP_FILE is None:
+    ENCODERS, KEYPADS = config.input_map(
+        SCREEN, DEEJ, BiT, key, hid, cc_code, repeat
+    )
+else:
+    KEYMAP = Keymap(config.KEYMAP_FILE, config.functions(SCREEN, DEEJ, hid))
+    ENCODERS, KEYPADS = KEYMAP.load_layer(KEYMAP.find_layer(config.KEYMAP_LAYER))
 
 
 def init_expander(scl, sda):
-    i2c = busio.I2C(scl, sda)
-    # Wait for I2C to be ready
-    while not i2c.try_lock():
-        pass
-    i2c.unlock()
-    return i2c
+    return I2CBus(
+        scl,
+        sda,
+        frequency=config.I2C_FREQUENCY,
+        fallback_frequency=config.I2C_FALLBACK_FREQUENCY,
+        addresses=(config.MATRIX_IO_EXPANDER_ADDRESS, config.BUTTON_IO_EXPANDER_ADDRESS),
+        input_masks=(
+            sum(1 << pin for pin in config.MATRIX_COL_PINS),
+            sum(1 << encoder["button"]["pin"] for encoder in ENCODERS),
+        ),
+    )
 
 
-def init_encoders(encoders_num):
+def init_encoders(encoders_num, events):
     """This loop is for looping through encoders pin and .
     So if there's 6 rotary encoders, encoders_num = 6
     (0, 6 * 2, 4) mean we start from 0, and since each encoder have 2 pins, multiplied by 2.
@@ -55,31 +100,47 @@ def init_encoders(encoders_num):
         dual_encoders.append(init_dual_encoder)
 
     """ After we get DualIncrementalEncoders we need to get value of each encoder and
-    apply action of the encoders
+    apply action of the encoders. EncoderBank read each DualIncrementalEncoder once
+    per tick and every SplitRotaryEncoder use the same snapshot of positions.
     """
+    bank = EncoderBank(dual_encoders)
     encoders = []
     for i in range(encoders_num):
-        group = i // 2  # integer division groups every two items
-        local_index = i % 2  # 0 or 1
+        encoder_map = ENCODERS[config.ROTARY_ENCODERS_PHYSICAL_ORDER[i] - 1]
         split_encoder = SplitRotaryEncoder(
             name=f"Encoder {i}",
-            encoder=dual_encoders[group],
-            index=local_index,
-            actions=ENCODERS[config.ROTARY_ENCODERS_PHYSICAL_ORDER[i] - 1]["actions"],
+            encoder=bank,
+            index=i,
+            actions=encoder_map["actions"],
+            acceleration=encoder_map.get("acceleration"),
+            events=events,
         )
         encoders.append(split_encoder)
 
-    return encoders
+    return bank, encoders
 
 
-def init_button_encoders(i2c):
-    expander = PCF8574(i2c, address=config.BUTTON_IO_EXPANDER_ADDRESS)
-    buttons = []
+def init_debouncer(num_keys):
+    if config.DEBOUNCE is None:
+        return None
+    return Debouncer(
+        num_keys,
+        algorithm=getattr(DebounceType, config.DEBOUNCE.upper()),
+        debounce=config.DEBOUNCE_TIME,
+        samples=config.DEBOUNCE_SAMPLES,
+    )
+
 
-    for encoder in ENCODERS:
-        button_pin = expander.get_pin(encoder["button"]["pin"])
-        button = Button(pin_button=button_pin, actions=encoder["button"]["actions"])
-        buttons.append(button)
+def init_button_encoders(i2c, events):
+    expander = PCF8574(i2c, address=config.BUTTON_IO_EXPANDER_ADDRESS)
+    buttons = ExpanderButtons(
+        expander=expander,
+        pins=[encoder["button"]["pin"] for encoder in ENCODERS],
+        actions=[encoder["button"]["actions"] for encoder in ENCODERS],
+        pin_interupt=config.BUTTON_INTERUPT_PIN,
+        debouncer=init_debouncer(len(ENCODERS)),
+        events=events,
+    )
     return buttons
 
 
@@ -87,7 +148,7 @@ def init_volumes_label():
     labels = []
     for i in range(DEEJ.num_programs):
         y = 50 + (i - 1) * 25
-        text = f"{DEEJ.volumes[i]} - {DEEJ.programs[i]}"
+        text = DEEJ.label_text(i)
         label = SCREEN.label(text, x=15, y=y)
         labels.append(label)
     return labels
@@ -98,38 +159,134 @@ def main():
         scl=config.IO_EXPANDER_PINS["SCL"], sda=config.IO_EXPANDER_PINS["SDA"]
     )
 
-    encoders = init_encoders(config.ROTARY_ENCODERS_NUM)
-    encoder_buttons = init_button_encoders(i2c)
+    profiler = Profiler(config.PROFILE)
+    events = EventQueue(config.EVENT_QUEUE_SIZE, profiler.histogram("queued"))
+    encoder_bank, encoders = init_encoders(config.ROTARY_ENCODERS_NUM, events)
+    encoder_buttons = init_button_encoders(i2c, events)
+
+    num_columns = len(config.MATRIX_COL_PINS)
+    matrix_debouncer = init_debouncer(len(config.MATRIX_ROW_PINS) * num_columns)
+    if matrix_debouncer is not None:
+        for (row, col), seconds in config.MATRIX_DEBOUNCE_KEYS.items():
+            matrix_debouncer.set_key(row * num_columns + col, debounce=seconds)
 
     keypad = ButtonMatrix(
         actions=KEYPADS,
         expander=PCF8574(i2c, address=config.MATRIX_IO_EXPANDER_ADDRESS),
         rows=config.MATRIX_ROW_PINS,
         columns=config.MATRIX_COL_PINS,
+        pin_interupt=config.MATRIX_INTERUPT_PIN,
+        settle=config.MATRIX_ROW_SETTLE,
+        debouncer=matrix_debouncer,
+        events=events,
     )
 
-    if config.USE_DEEJ:
-        labels = init_volumes_label()
+    if config.KEYMAP_FILE is not None:
+        # Only the profile layer is compiled now, others on their first use
+        profile = KEYMAP.find_layer(config.KEYMAP_LAYER)
+        layers = [None] * len(KEYMAP.layer_names)
+        layers[profile] = (ENCODERS, KEYPADS)
+        LayerStack(
+            layers,
+            matrix=keypad,
+            buttons=encoder_buttons,
+            encoders=encoders,
+            encoder_order=config.ROTARY_ENCODERS_PHYSICAL_ORDER,
+            profile=profile,
+            load_layer=KEYMAP.load_layer,
+        )
 
-    slideshow = display.Slideshow(SCREEN.images_group)
-    # gif = display.PlayGif("media/mon.gif", SCREEN.gif_group, SCREEN.display)
+    slideshow = display.Slideshow(
+        SCREEN.images_group, dwell=config.SLIDESHOW_DWELL, cache_size=config.SLIDESHOW_CACHE
+    )
     SCREEN.show_screen()
 
-    while True:
+    def encoders_task():
+        encoder_bank.poll()
         for encoder in encoders:
-            turned = encoder.encoder_action()
+            encoder.encoder_action()
+
+    hid.REPORT.set_nkro(config.USE_NKRO)
+
+    events.handlers[EventSource.MATRIX] = keypad.handle_event
+    events.handlers[EventSource.BUTTONS] = encoder_buttons.handle_event
+    events.handlers[EventSource.ENCODER] = lambda index, delta: encoders[index].turn(
+        delta, events.time
+    )
+
+    scheduler = Scheduler(profiler)
+    alloc_check = AllocCheck(
+        None if config.ALLOC_CHECK is None else getattr(AllocCheckMode, config.ALLOC_CHECK.upper())
+    )
+    for name, callback in (
+        ("dispatch", events.dispatch),
+        ("hid", hid.REPORT.flush),
+        ("encoders", encoders_task),
+        ("buttons", encoder_buttons.button_scanning),
+        ("matrix", keypad.matrix_scanning),
+    ):
+        scheduler.add(name, alloc_check.wrap(name, callback), *config.TASKS[name])
+
+    def input_busy():
+        # Key held, knob turning or HID report waiting, display work can wait
+        return bool(
+            keypad.state
+            or encoder_buttons.state
+            or encoder_bank.moved
+            or events.count
+            or hid.MACRO.playing
+            or hid.REPORT.pending()
+        )
+
+    def slideshow_task():
+        if slideshow.update(input_busy()):
+            SCREEN.mark_dirty()
+
+    scheduler.add("macro", hid.MACRO.update, *config.TASKS["macro"])
+    scheduler.add("slideshow", slideshow_task, *config.TASKS["slideshow"])
+
+    gc_policy = GCPolicy(config.GC_LOW_WATER, config.GC_MAX_INTERVAL)
+    scheduler.add(
+        "gc", lambda: gc_policy.collect_if_idle(input_busy()), *config.TASKS["gc"]
+    )
+
+    if config.GIF_FILE is not None:
+        gif = display.PlayGif(config.GIF_FILE, SCREEN.gif_group, SCREEN)
+
+        def gif_task():
+            gif.update_gif(input_busy())
+
+        scheduler.add("gif", gif_task, *config.TASKS["gif"])
+
+    if config.USE_DEEJ:
+        labels = init_volumes_label()
+
+        def deej_task():
+            DEEJ.poll()
+            DEEJ.flush()
+            DEEJ.save(config.DEEJ_SAVE_DELAY)
+            # Text is applied on the next display frame, many volume changes in
+            # one frame are drawn once
+            for i in range(DEEJ.num_programs):
+                if DEEJ.updated[i]:
+                    DEEJ.updated[i] = 0
+                    SCREEN.set_text(labels[i], DEEJ.label_text(i))
+            SCREEN.set_text(labels[DEEJ.current_program_index], DEEJ.display)
+
+        scheduler.add("deej", deej_task, *config.TASKS["deej"])
+
+    scheduler.add("display", SCREEN.refresh_frame, *config.TASKS["display"])
+
+    if config.PROFILE:
 
-            if turned and config.USE_DEEJ:
-                labels[DEEJ.current].text = DEEJ.display
+        profiler.reports.append(i2c.dump)
 
-        for button in encoder_buttons:
-            button.button_action()
+        def profile_task():
+            profiler.poll(usb_cdc.console, config.PROFILE_DUMP)
 
-        keypad.matrix_scanning()
-        slideshow.update()
-        # gif.update_gif()
+        scheduler.add("profile", profile_task, *config.TASKS["profile"])
 
-        time.sleep(0.01)
+    asyncio.run(scheduler.run())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,27 @@
+"""CPython simulation of the macropad hardware.
+
+``install()`` put the stand-in CircuitPython modules from ``shims`` and the
+firmware ``lib`` folder on ``sys.path`` so ``main.py`` can be imported and
+run on a PC. The simulated board itself is ``hardware.HARDWARE``.
+"""
+
+import gc
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHIMS = os.path.join(ROOT, "simulator", "shims")
+LIB = os.path.join(ROOT, "lib")
+
+
+def install():
+    for path in (ROOT, LIB, SHIMS):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    # gc is built in so it can't be replaced by a shim, add the CircuitPython call
+    from simulator.hardware import HARDWARE
+
+    gc.mem_free = lambda: HARDWARE.ram_free
+    # No gc.mem_alloc: CPython heap (and the simulator's own recording) say nothing
+    # about the Pico heap, so memory.AllocCheck fail here instead of never firing.
@@ -0,0 +1,390 @@
+"""Latency benchmark of the firmware running on the simulated hardware.
+
+A scripted trace of key presses, encoder button presses and encoder turns is
+played through ``main.main()`` and the benchmark report:
+
+- scan rate of the key matrix and the encoders
+- latency from the physical input to the first USB HID report after it
+- I2C transactions per matrix scan, per matrix task tick and per second
+
+Usage, from the repository root:
+
+    python simulator/bench.py
+    python simulator/bench.py --interupt --json bench.json
+    python simulator/bench.py --compare bench.json  # exit 1 on regression
+"""
+
+import argparse
+import json
+import os
+import runpy
+import struct
+import sys
+import tempfile
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import simulator
+from simulator.hardware import HARDWARE, SimulationEnd, Trace
+
+
+def write_bmp(path: str, width: int, height: int):
+    """Write blank 8-bit palette BMP, rows padded to 4 bytes like the real ones"""
+    row_size = (width + 3) & ~3
+    palette = bytes(256 * 4)
+    offset = 14 + 40 + len(palette)
+    size = offset + row_size * height
+    with open(path, "wb") as f:
+        f.write(struct.pack("<2sIHHI", b"BM", size, 0, 0, offset))
+        f.write(struct.pack("<IiiHHIIiiII", 40, width, height, 1, 8, 0, 0, 0, 0, 256, 0))
+        f.write(palette)
+        f.write(bytes(row_size * height))
+
+
+def write_gif(path: str, width: int, height: int, frames: int, delay: float):
+    """Write GIF with the real block structure, image data is a dummy sub-block"""
+    with open(path, "wb") as f:
+        f.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0, 0, 0))
+        for _ in range(frames):
+            f.write(struct.pack("<BBBBHBB", 0x21, 0xF9, 4, 0, round(delay * 100), 0, 0))
+            f.write(struct.pack("<BHHHHB", 0x2C, 0, 0, width, height, 0))
+            f.write(b"\x08\x01\x00\x00")
+        f.write(b"\x3B")
+
+
+def write_gif_pack(path: str, width: int, height: int, frames: int, delay: float):
+    """Write frame pack the way image-to-bmp make it for lib/display.py"""
+    with open(path, "wb") as f:
+        f.write(struct.pack("<4sHHH", b"GFP1", width, height, frames))
+        f.write(struct.pack(f"<{frames}H", *[round(delay * 1000)] * frames))
+        for i in range(frames):
+            f.write(bytes([i & 0xFF]) * (width * height * 2))
+
+
+def collect_instances(cls, found: list):
+    original = cls.__init__
+
+    def collect(self, *args, **kwargs):
+        original(self, *args, **kwargs)
+        found.append(self)
+
+    cls.__init__ = collect
+
+
+def deej_host_frames(count: int, duration: float) -> dict:
+    """Host change a volume `count` times while the trace run, same frames as
+    deej-host/deej_sync.py. Return the last volume of every program."""
+    import deej
+
+    volumes = {}
+    for i in range(count):
+        index = i % 3
+        volume = (i * 7 + 10) % 101
+        frame = bytes([deej.HOST_FRAME_START, deej.HostOp.VOLUME, index, 1, volume])
+        frame += bytes([sum(frame) & 0xFF])
+        HARDWARE.host_send(duration * (i + 0.5) / count, "data", frame)
+        volumes[index] = volume
+    return volumes
+
+
+def default_trace(
+    events: int, spacing: float, rows: int, columns: int, encoders: int, bounce: float = 0
+):
+    """Alternate key presses, encoder turns and encoder button presses"""
+    trace = Trace()
+    at = 0.3  # leave time for main() to initialize
+    for i in range(events):
+        kind = i % 4
+        if kind in (0, 2):
+            trace.key(
+                at, row=1 + (i // 4) % (rows - 1), col=(i // 2) % columns, bounce=bounce
+            )
+        elif kind == 1:
+            trace.turn(at, encoder=(i // 4) % encoders, detents=1 + (i // 4) % 3)
+        else:
+            trace.button(at, index=(i // 4) % encoders, bounce=bounce)
+        at += spacing
+    return trace
+
+
+def count_calls(cls, name: str, counter: dict):
+    original = getattr(cls, name)
+
+    def counted(*args, **kwargs):
+        if counter[name] == 0:
+            counter["first_call"] = HARDWARE.now()
+            counter["i2c_baseline"] = dict(HARDWARE.i2c_transactions)
+        counter[name] += 1
+        return original(*args, **kwargs)
+
+    counter[name] = 0
+    setattr(cls, name, counted)
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def input_latencies(trace: Trace, reports: list):
+    """Time from each input event to the first HID report that follow it,
+    events with no report before the next event are counted as silent."""
+    events = sorted(trace.presses)
+    latencies = {}
+    silent = 0
+    report_times = [r[0] for r in reports]
+    j = 0
+    for i, (at, kind, _) in enumerate(events):
+        next_at = events[i + 1][0] if i + 1 < len(events) else float("inf")
+        while j < len(report_times) and report_times[j] < at:
+            j += 1
+        if j < len(report_times) and report_times[j] < next_at:
+            latencies.setdefault(kind, []).append(report_times[j] - at)
+        else:
+            silent += 1
+    return latencies, silent
+
+
+def run(args) -> dict:
+    HARDWARE.reset(
+        i2c_overhead=args.i2c_overhead / 1e6,
+        hid_report_cost=args.hid_report_cost / 1e3,
+        display_refresh_cost=args.display_refresh_cost / 1e3,
+        gif_frame_cost=args.gif_frame_cost / 1e3,
+        ram_free=args.ram_free,
+        i2c_max_frequency=args.i2c_max_frequency * 1000,
+    )
+    simulator.install()
+
+    import board
+    import config
+    import display
+
+    media = tempfile.mkdtemp(prefix="macropad-media-")
+    write_bmp(os.path.join(media, "0.bmp"), 240, 240)
+    display.MEDIA_FOLDER = media
+
+    if args.gif:
+        config.GIF_FILE = os.path.join(media, "bench.gif")
+        write_gif(config.GIF_FILE, 120, 120, args.gif, delay=0.1)
+        if args.gif_pack:
+            write_gif_pack(os.path.join(media, "bench.gfp"), 120, 120, args.gif, 0.1)
+
+    if args.keymap:
+        config.KEYMAP_FILE = args.keymap
+
+    if args.deej_host:
+        config.USE_DEEJ = True
+        config.DEEJ_BINARY = True
+        host_volumes = deej_host_frames(args.deej_host, args.events * args.spacing / 1e3)
+
+    if args.profile:
+        config.PROFILE = True
+
+    if args.nkro:
+        config.USE_NKRO = True
+        runpy.run_path(os.path.join(simulator.ROOT, "boot.py"))  # enable the NKRO device
+
+    if args.event_queue is not None:
+        config.EVENT_QUEUE_SIZE = args.event_queue
+
+    if args.debounce_time is not None:
+        config.DEBOUNCE_TIME = args.debounce_time / 1e3
+
+    if args.interupt:
+        config.MATRIX_INTERUPT_PIN = board.GP16
+        config.BUTTON_INTERUPT_PIN = board.GP25
+        HARDWARE.attach_interupt(board.GP16, config.MATRIX_IO_EXPANDER_ADDRESS)
+        HARDWARE.attach_interupt(board.GP25, config.BUTTON_IO_EXPANDER_ADDRESS)
+
+    import debounce
+    import macropad
+    import main
+
+    debouncers = []
+    collect_instances(debounce.Debouncer, debouncers)
+    gifs = []
+    collect_instances(display.PlayGif, gifs)
+    import profiler
+
+    profilers = []
+    collect_instances(profiler.Profiler, profilers)
+    import memory
+
+    gc_policies = []
+    collect_instances(memory.GCPolicy, gc_policies)
+    import events
+
+    queues = []
+    collect_instances(events.EventQueue, queues)
+    import i2c_bus
+
+    buses = []
+    collect_instances(i2c_bus.I2CBus, buses)
+
+    HARDWARE.attach_matrix(
+        config.MATRIX_IO_EXPANDER_ADDRESS, config.MATRIX_ROW_PINS, config.MATRIX_COL_PINS
+    )
+    HARDWARE.attach_buttons(
+        config.BUTTON_IO_EXPANDER_ADDRESS,
+        [encoder["button"]["pin"] for encoder in main.ENCODERS],
+    )
+
+    counter = {}
+    count_calls(macropad.ButtonMatrix, "matrix_scanning", counter)
+    count_calls(macropad.ButtonMatrix, "dispatch_changes", counter)
+    count_calls(macropad.SplitRotaryEncoder, "encoder_action", counter)
+
+    trace = default_trace(
+        args.events,
+        args.spacing / 1e3,
+        rows=len(config.MATRIX_ROW_PINS),
+        columns=len(config.MATRIX_COL_PINS),
+        encoders=config.ROTARY_ENCODERS_NUM,
+        bounce=args.bounce / 1e3,
+    )
+    HARDWARE.run(trace)
+    try:
+        main.main()
+    except SimulationEnd:
+        pass
+    for instance in profilers:
+        if instance.enabled:
+            instance.dump()
+
+    elapsed = HARDWARE.end - counter.get("first_call", 0.0)
+    ticks = counter["matrix_scanning"]
+    scans = counter["dispatch_changes"]
+    baseline = counter.get("i2c_baseline", {})
+    i2c = {
+        f"0x{address:02X}": count - baseline.get(address, 0)
+        for address, count in sorted(HARDWARE.i2c_transactions.items())
+    }
+    total_i2c = sum(i2c.values())
+    latencies, silent = input_latencies(trace, HARDWARE.hid_reports)
+    all_latencies = [value for values in latencies.values() for value in values]
+
+    return {
+        "matrix_scan_hz": scans / elapsed,
+        "matrix_tick_hz": ticks / elapsed,
+        "encoder_poll_hz": counter["encoder_action"] / config.ROTARY_ENCODERS_NUM / elapsed,
+        "latency_ms": {
+            kind: {
+                "count": len(values),
+                "p50": percentile(values, 0.5) * 1e3,
+                "p99": percentile(values, 0.99) * 1e3,
+                "max": max(values) * 1e3,
+            }
+            for kind, values in sorted(latencies.items())
+        },
+        "latency_p50_ms": percentile(all_latencies, 0.5) * 1e3,
+        "latency_p99_ms": percentile(all_latencies, 0.99) * 1e3,
+        "silent_events": silent,
+        "hid_reports": len(HARDWARE.hid_reports),
+        "bounces_suppressed": sum(debouncer.suppressed for debouncer in debouncers),
+        "i2c_per_scan": total_i2c / scans if scans else 0.0,
+        "i2c_per_tick": total_i2c / ticks if ticks else 0.0,
+        "i2c_per_second": total_i2c / elapsed,
+        "i2c_by_device": i2c,
+        "i2c_frequency": buses[0].frequency if buses else 0,
+        "display_refreshes": HARDWARE.display_refreshes,
+        "event_overflows": sum(queue.overflows for queue in queues),
+        "gc_collections": sum(policy.collections for policy in gc_policies),
+        "gif_frames_shown": sum(gif.shown for gif in gifs),
+        "gif_frames_skipped": sum(gif.skipped for gif in gifs),
+        "deej_host_frames": args.deej_host,
+        "deej_in_sync": not args.deej_host
+        or all(main.DEEJ.volumes[i] == volume for i, volume in host_volumes.items()),
+        "encoder_lost_transitions": sum(
+            pair.lost_transitions for pair in HARDWARE.encoder_pairs.values()
+        ),
+    }
+
+
+def print_result(result: dict):
+    print(f"matrix scan rate     {result['matrix_scan_hz']:8.1f} Hz")
+    print(f"matrix task rate     {result['matrix_tick_hz']:8.1f} Hz")
+    print(f"encoder poll rate    {result['encoder_poll_hz']:8.1f} Hz")
+    for kind, stats in result["latency_ms"].items():
+        print(
+            f"{kind + ' latency':<20} p50 {stats['p50']:6.2f} ms"
+            f"  p99 {stats['p99']:6.2f} ms  max {stats['max']:6.2f} ms  (n={stats['count']})"
+        )
+    print(f"silent input events  {result['silent_events']:8d}")
+    print(f"HID reports          {result['hid_reports']:8d}")
+    print(f"bounces suppressed   {result['bounces_suppressed']:8d}")
+    print(f"I2C clock            {result['i2c_frequency'] / 1000:8.0f} kHz")
+    print(f"I2C per matrix scan  {result['i2c_per_scan']:8.2f}")
+    print(f"I2C per matrix tick  {result['i2c_per_tick']:8.2f}")
+    print(f"I2C per second       {result['i2c_per_second']:8.1f}")
+    for address, count in result["i2c_by_device"].items():
+        print(f"  expander {address}    {count:8d}")
+    print(f"display refreshes    {result['display_refreshes']:8d}")
+    print(f"event overflows      {result['event_overflows']:8d}")
+    print(f"GC collections       {result['gc_collections']:8d}")
+    print(f"GIF frames shown     {result['gif_frames_shown']:8d}")
+    print(f"GIF frames skipped   {result['gif_frames_skipped']:8d}")
+    if result["deej_host_frames"]:
+        print(f"deej host frames     {result['deej_host_frames']:8d}")
+        print(f"deej in sync         {str(result['deej_in_sync']):>8}")
+    print(f"encoder lost steps   {result['encoder_lost_transitions']:8d}")
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Return list of regressions, bigger is worse for latency and I2C traffic"""
+    regressions = []
+    for key in ("latency_p50_ms", "latency_p99_ms", "i2c_per_scan"):
+        if result[key] > baseline[key] * (1 + tolerance) + 1e-9:
+            regressions.append(f"{key}: {baseline[key]:.2f} -> {result[key]:.2f}")
+    for key in ("matrix_scan_hz", "encoder_poll_hz"):
+        if result[key] < baseline[key] * (1 - tolerance):
+            regressions.append(f"{key}: {baseline[key]:.2f} -> {result[key]:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=40, help="number of input events")
+    parser.add_argument("--spacing", type=float, default=150, help="ms between events")
+    parser.add_argument("--interupt", action="store_true", help="wire PCF8574 INT pins")
+    parser.add_argument("--bounce", type=float, default=0, help="ms of switch chatter")
+    parser.add_argument("--debounce-time", type=float, help="ms, override config")
+    parser.add_argument("--gif", type=int, default=0, help="play GIF with this many frames")
+    parser.add_argument("--gif-pack", action="store_true", help="with .gfp frame pack")
+    parser.add_argument("--event-queue", type=int, help="event queue size, override config")
+    parser.add_argument("--ram-free", type=int, default=150_000, help="bytes for gc.mem_free")
+    parser.add_argument("--keymap", help="binary keymap to use instead of input_map")
+    parser.add_argument("--deej-host", type=int, default=0, help="host volume changes")
+    parser.add_argument("--nkro", action="store_true", help="enable NKRO keyboard like boot.py")
+    parser.add_argument("--profile", action="store_true", help="print task durations")
+    parser.add_argument("--i2c-overhead", type=float, default=20, help="us per transaction")
+    parser.add_argument("--i2c-max-frequency", type=int, default=400, help="kHz")
+    parser.add_argument("--hid-report-cost", type=float, default=1, help="ms per report")
+    parser.add_argument("--display-refresh-cost", type=float, default=40, help="ms")
+    parser.add_argument("--gif-frame-cost", type=float, default=60, help="ms per frame")
+    parser.add_argument("--json", help="save the result to this file")
+    parser.add_argument("--compare", help="compare with result saved by --json")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    result = run(args)
+    print_result(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
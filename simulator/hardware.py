@@ -0,0 +1,326 @@
+"""Simulated macropad hardware.
+
+Every stand-in module in ``simulator/shims`` talk to the single ``HARDWARE``
+object defined here. It model the parts of the board the firmware cares
+about: the I2C bus with the two PCF8574 expanders, the key matrix wiring,
+the rotary encoders behind the PIO state machines and the USB HID reports.
+
+Time is real (``time.perf_counter``), bus costs are spent by busy waiting so
+the firmware see the same kind of stall it would see on the Pico.
+"""
+
+import time
+from collections import deque
+
+# Quadrature pin state of one encoder channel for every quarter step, going
+# forward through this sequence is counted as positive by DualIncrementalEncoder
+QUADRATURE_SEQUENCE = (0b11, 0b01, 0b00, 0b10)
+PIO_FIFO_DEPTH = 4
+
+
+class SimulationEnd(BaseException):
+    """Raised from inside a shim when the scripted trace is over.
+
+    It's a BaseException so the firmware ``except ValueError/OSError`` blocks
+    won't swallow it and it stop ``asyncio.run`` in ``main()``.
+    """
+
+
+def spend(seconds: float):
+    """Busy wait, time.sleep() is far too coarse for I2C transaction costs"""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class Trace:
+    """Scripted input, all times are seconds from the start of simulation."""
+
+    def __init__(self):
+        self.keys = []  # (start, end, row, col)
+        self.buttons = []  # (start, end, index)
+        self.turns = []  # (start, encoder, detents, speed in detents/s)
+        self.presses = []  # (time, kind, detail) every input event, for latency
+
+    @staticmethod
+    def contacts(at: float, hold: float, bounce: float):
+        """Closed intervals of a switch, with `bounce` seconds of on/off chatter
+        after the press and after the release, four glitches each."""
+        end = at + hold
+        step = bounce / 8
+        intervals = []
+        for i in range(4 if bounce else 0):
+            intervals.append((at + 2 * i * step, at + (2 * i + 1) * step))
+        intervals.append((at + bounce, end))
+        for i in range(4 if bounce else 0):
+            intervals.append((end + (2 * i + 1) * step, end + (2 * i + 2) * step))
+        return intervals
+
+    def key(self, at: float, row: int, col: int, hold: float = 0.05, bounce: float = 0):
+        for start, end in self.contacts(at, hold, bounce):
+            self.keys.append((start, end, row, col))
+        self.presses.append((at, "key", f"R{row}C{col}"))
+        return self
+
+    def button(self, at: float, index: int, hold: float = 0.05, bounce: float = 0):
+        for start, end in self.contacts(at, hold, bounce):
+            self.buttons.append((start, end, index))
+        self.presses.append((at, "button", f"B{index}"))
+        return self
+
+    def turn(self, at: float, encoder: int, detents: int, speed: float = 20.0):
+        self.turns.append((at, encoder, detents, speed))
+        self.presses.append((at, "encoder", f"E{encoder}{detents:+d}"))
+        return self
+
+    @property
+    def end(self) -> float:
+        ends = [k[1] for k in self.keys] + [b[1] for b in self.buttons]
+        ends += [t[0] + abs(t[2]) / t[3] for t in self.turns]
+        return max(ends, default=0.0)
+
+    def pressed_keys(self, now: float):
+        return [(r, c) for start, end, r, c in self.keys if start <= now < end]
+
+    def pressed_buttons(self, now: float):
+        return [i for start, end, i in self.buttons if start <= now < end]
+
+    def quarter_position(self, encoder: int, now: float) -> int:
+        position = 0
+        for start, index, detents, speed in self.turns:
+            if index != encoder or now < start:
+                continue
+            quarters = min(int((now - start) * speed * 4), abs(detents) * 4)
+            position += quarters if detents > 0 else -quarters
+        return position
+
+
+class Expander:
+    """PCF8574 quasi-bidirectional port: a pin reads low when its output latch
+    is low or when something outside pulls it low (a pressed key)."""
+
+    def __init__(self, hardware, address: int):
+        self.hardware = hardware
+        self.address = address
+        self.latch = 0xFF
+        self.last_read = 0xFF  # power-on state, INT compare against it
+        self.pulled_low = lambda: 0  # replaced when the wiring is attached
+
+    def port(self) -> int:
+        return self.latch & ~self.pulled_low() & 0xFF
+
+    def read(self) -> int:
+        self.last_read = self.port()
+        return self.last_read
+
+    def write(self, value: int):
+        self.latch = value & 0xFF
+
+    @property
+    def interupt(self) -> bool:
+        """INT pin level, it's active low and goes low when input changed
+        since the last read."""
+        return self.port() == self.last_read
+
+
+class EncoderPair:
+    """The two encoders read by one DualIncrementalEncoder state machine."""
+
+    def __init__(self, hardware, first_pin: int):
+        self.hardware = hardware
+        self.encoders = (first_pin // 2, first_pin // 2 + 1)
+        self.quarters = [0, 0]
+        self.fifo = deque()
+        self.last_pushed = 0b1111
+        self.fifo.append(self.last_pushed)  # y start at 31, first sample always pushed
+        self.stalled_state = None
+        self.rxstall = False
+        self.lost_transitions = 0
+
+    def pin_state(self) -> int:
+        a = QUADRATURE_SEQUENCE[self.quarters[0] % 4]
+        b = QUADRATURE_SEQUENCE[self.quarters[1] % 4]
+        return a | (b << 2)
+
+    def push(self, state: int):
+        if state == self.last_pushed:
+            return
+        if len(self.fifo) < PIO_FIFO_DEPTH:
+            self.fifo.append(state)
+            self.last_pushed = state
+        else:
+            # State machine stall on full FIFO, intermediate states are lost
+            if self.stalled_state is not None:
+                self.lost_transitions += 1
+            self.stalled_state = state
+            self.rxstall = True
+
+    def advance(self):
+        now = self.hardware.now()
+        trace = self.hardware.trace
+        targets = [trace.quarter_position(e, now) for e in self.encoders]
+        while self.quarters != targets:
+            for channel in (0, 1):
+                difference = targets[channel] - self.quarters[channel]
+                if difference:
+                    self.quarters[channel] += 1 if difference > 0 else -1
+                    self.push(self.pin_state())
+
+    def pop(self) -> int:
+        value = self.fifo.popleft()
+        if self.stalled_state is not None:
+            state = self.stalled_state
+            self.stalled_state = None
+            self.push(state)
+        return value
+
+
+class Hardware:
+    def __init__(self):
+        self.reset()
+
+    def reset(
+        self,
+        i2c_overhead: float = 20e-6,
+        hid_report_cost: float = 1e-3,
+        display_refresh_cost: float = 40e-3,
+        gif_frame_cost: float = 60e-3,
+        flash_read_rate: float = 4e6,
+        ram_free: int = 150_000,
+        serial_byte_cost: float = 10e-6,
+        i2c_max_frequency: int = 400_000,
+    ):
+        """Clear all state, costs are in seconds.
+
+        i2c_overhead is spent on every transaction on top of the time needed to
+        clock the bits out at the bus frequency.
+        """
+        self.i2c_overhead = i2c_overhead
+        self.hid_report_cost = hid_report_cost
+        self.display_refresh_cost = display_refresh_cost
+        self.gif_frame_cost = gif_frame_cost
+        self.flash_read_rate = flash_read_rate  # bytes per second
+        self.ram_free = ram_free  # what gc.mem_free() report
+        self.serial_byte_cost = serial_byte_cost
+        self.i2c_max_frequency = i2c_max_frequency  # faster clock give I/O errors
+        self.trace = Trace()
+        self.start = time.perf_counter()
+        self.end = None
+        self.expanders = {}
+        self.encoder_pairs = {}
+        self.gpio = {}  # pin name -> DigitalInOut shim
+        self.gpio_inputs = {}  # pin name -> callable returning the pin level
+        self.i2c_transactions = {}  # address -> count
+        self.i2c_bytes = {}  # address -> count
+        self.hid_reports = []  # (time, device name, report bytes)
+        self.display_refreshes = 0
+        self.serial_writes = []  # (time, port name, bytes)
+        self.serial_inputs = []  # (time, port name, bytes) sent by the host
+        self.serial_received = {}  # port name -> bytearray arrived but not read yet
+
+    def now(self) -> float:
+        now = time.perf_counter() - self.start
+        if self.end is not None and now >= self.end:
+            raise SimulationEnd()
+        return now
+
+    def run(self, trace: Trace, tail: float = 0.2):
+        """Start the clock, simulation will end `tail` seconds after the trace"""
+        self.trace = trace
+        self.start = time.perf_counter()
+        self.end = trace.end + tail
+
+    # I2C
+    def expander(self, address: int) -> Expander:
+        if address not in self.expanders:
+            self.expanders[address] = Expander(self, address)
+        return self.expanders[address]
+
+    def i2c_transfer(self, address: int, nbytes: int, frequency: int):
+        self.now()
+        if address not in self.expanders:
+            raise OSError(19, "No such device")  # same errno CircuitPython use
+        if frequency > self.i2c_max_frequency:
+            raise OSError(5, "Input/output error")
+        self.i2c_transactions[address] = self.i2c_transactions.get(address, 0) + 1
+        self.i2c_bytes[address] = self.i2c_bytes.get(address, 0) + nbytes
+        # start + address byte + data bytes, every byte is 9 clocks with ACK
+        spend(self.i2c_overhead + (1 + nbytes) * 9 / frequency)
+
+    # Wiring
+    def attach_matrix(self, address: int, row_pins: list, column_bits: list):
+        expander = self.expander(address)
+
+        def pulled_low():
+            mask = 0
+            for r, c in self.trace.pressed_keys(self.now()):
+                row = self.gpio.get(row_pins[r].name)
+                if row is not None and row.driving_low():
+                    mask |= 1 << column_bits[c]
+            return mask
+
+        expander.pulled_low = pulled_low
+
+    def attach_buttons(self, address: int, pin_bits: list):
+        expander = self.expander(address)
+
+        def pulled_low():
+            mask = 0
+            for i in self.trace.pressed_buttons(self.now()):
+                mask |= 1 << pin_bits[i]
+            return mask
+
+        expander.pulled_low = pulled_low
+
+    def attach_interupt(self, pin, address: int):
+        expander = self.expander(address)
+        self.gpio_inputs[pin.name] = lambda: expander.interupt
+
+    def encoder_pair(self, first_pin: int) -> EncoderPair:
+        if first_pin not in self.encoder_pairs:
+            self.encoder_pairs[first_pin] = EncoderPair(self, first_pin)
+        return self.encoder_pairs[first_pin]
+
+    # USB HID
+    def hid_report(self, device_name: str, report: bytes):
+        self.hid_reports.append((self.now(), device_name, bytes(report)))
+        spend(self.hid_report_cost)
+
+    # USB serial
+    def serial_write(self, name: str, data):
+        self.serial_writes.append((self.now(), name, bytes(data)))
+        spend(len(data) * self.serial_byte_cost)
+
+    def host_send(self, at: float, name: str, data: bytes):
+        """Host write `data` to the serial port `at` seconds into the trace"""
+        self.serial_inputs.append((at, name, bytes(data)))
+        self.serial_inputs.sort(key=lambda item: item[0])
+
+    def serial_waiting(self, name: str) -> bytearray:
+        now = self.now()
+        received = self.serial_received.setdefault(name, bytearray())
+        while self.serial_inputs and self.serial_inputs[0][0] <= now:
+            _, port, data = self.serial_inputs.pop(0)
+            self.serial_received.setdefault(port, bytearray()).extend(data)
+        return received
+
+    def serial_read(self, name: str, nbytes: int) -> bytes:
+        received = self.serial_waiting(name)
+        data = bytes(received[:nbytes])
+        del received[:nbytes]
+        spend(len(data) * self.serial_byte_cost)
+        return data
+
+    # Flash
+    def flash_read(self, nbytes: int):
+        self.now()
+        spend(nbytes / self.flash_read_rate)
+
+    # Display
+    def display_refresh(self):
+        self.now()
+        self.display_refreshes += 1
+        spend(self.display_refresh_cost)
+
+
+HARDWARE = Hardware()
@@ -0,0 +1,71 @@
+"""Stand-in for ``adafruit_hid.keyboard_layout_us``"""
+
+from .keycode import Keycode
+
+_SHIFT_FLAG = 0x80
+_SYMBOLS = {
+    " ": Keycode.SPACE,
+    "\n": Keycode.ENTER,
+    "\t": Keycode.TAB,
+    "-": Keycode.MINUS,
+    "=": Keycode.EQUALS,
+    "[": Keycode.LEFT_BRACKET,
+    "]": Keycode.RIGHT_BRACKET,
+    "\\": Keycode.BACKSLASH,
+    ";": Keycode.SEMICOLON,
+    "'": Keycode.QUOTE,
+    "`": Keycode.GRAVE_ACCENT,
+    ",": Keycode.COMMA,
+    ".": Keycode.PERIOD,
+    "/": Keycode.FORWARD_SLASH,
+    "_": Keycode.MINUS | _SHIFT_FLAG,
+    "+": Keycode.EQUALS | _SHIFT_FLAG,
+    "{": Keycode.LEFT_BRACKET | _SHIFT_FLAG,
+    "}": Keycode.RIGHT_BRACKET | _SHIFT_FLAG,
+    "|": Keycode.BACKSLASH | _SHIFT_FLAG,
+    ":": Keycode.SEMICOLON | _SHIFT_FLAG,
+    '"': Keycode.QUOTE | _SHIFT_FLAG,
+    "~": Keycode.GRAVE_ACCENT | _SHIFT_FLAG,
+    "<": Keycode.COMMA | _SHIFT_FLAG,
+    ">": Keycode.PERIOD | _SHIFT_FLAG,
+    "?": Keycode.FORWARD_SLASH | _SHIFT_FLAG,
+    "!": Keycode.ONE | _SHIFT_FLAG,
+    "@": Keycode.TWO | _SHIFT_FLAG,
+    "#": Keycode.THREE | _SHIFT_FLAG,
+    "$": Keycode.FOUR | _SHIFT_FLAG,
+    "%": Keycode.FIVE | _SHIFT_FLAG,
+    "^": Keycode.SIX | _SHIFT_FLAG,
+    "&": Keycode.SEVEN | _SHIFT_FLAG,
+    "*": Keycode.EIGHT | _SHIFT_FLAG,
+    "(": Keycode.NINE | _SHIFT_FLAG,
+    ")": Keycode.ZERO | _SHIFT_FLAG,
+}
+
+
+class KeyboardLayoutUS:
+    def __init__(self, keyboard):
+        self.keyboard = keyboard
+
+    def _char_to_keycode(self, char: str) -> int:
+        if "a" <= char <= "z":
+            return Keycode.A + ord(char) - ord("a")
+        if "A" <= char <= "Z":
+            return (Keycode.A + ord(char) - ord("A")) | _SHIFT_FLAG
+        if "1" <= char <= "9":
+            return Keycode.ONE + ord(char) - ord("1")
+        if char == "0":
+            return Keycode.ZERO
+        if char in _SYMBOLS:
+            return _SYMBOLS[char]
+        raise ValueError(f"No keycode available for character {ord(char)} ({char}).")
+
+    def keycodes(self, char: str) -> tuple:
+        keycode = self._char_to_keycode(char)
+        if keycode & _SHIFT_FLAG:
+            return (Keycode.LEFT_SHIFT, keycode & ~_SHIFT_FLAG)
+        return (keycode,)
+
+    def write(self, string: str, delay: float = None):
+        for char in string:
+            self.keyboard.press(*self.keycodes(char))
+            self.keyboard.release_all()
@@ -0,0 +1,18 @@
+"""Stand-in for ``adafruit_st7789``, refreshes are charged to the simulated SPI bus"""
+
+from simulator.hardware import HARDWARE
+
+
+class ST7789:
+    def __init__(self, bus, *, width, height, rotation=0, auto_refresh=True, **kwargs):
+        self.bus = bus
+        self.width = width
+        self.height = height
+        self.rotation = rotation
+        self.root_group = None
+        self.auto_refresh = auto_refresh
+        self.brightness = 1.0
+
+    def refresh(self, *, target_frames_per_second=None, minimum_frames_per_second=0):
+        HARDWARE.display_refresh()
+        return True
@@ -0,0 +1,34 @@
+"""Stand-in for ``bitmaptools``, only the calls the firmware use"""
+
+from array import array
+
+from simulator.hardware import HARDWARE
+
+
+def blit(dest_bitmap, source_bitmap, x, y, **kwargs):
+    width = min(source_bitmap.width, dest_bitmap.width - x)
+    for row in range(min(source_bitmap.height, dest_bitmap.height - y)):
+        start = row * source_bitmap.width
+        offset = (y + row) * dest_bitmap.width + x
+        dest_bitmap._pixels[offset : offset + width] = source_bitmap._pixels[
+            start : start + width
+        ]
+
+
+def readinto(
+    bitmap,
+    file,
+    bits_per_pixel,
+    element_size=1,
+    reverse_pixels_in_element=False,
+    swap_bytes_in_element=False,
+    reverse_rows=False,
+):
+    if bits_per_pixel != 16 or element_size != 2:
+        raise NotImplementedError("only 16 bit pixels are simulated")
+    data = file.read(bitmap.width * bitmap.height * 2)
+    HARDWARE.flash_read(len(data))
+    pixels = array("H", data)
+    if swap_bytes_in_element:
+        pixels.byteswap()
+    bitmap._pixels = pixels.tolist()
@@ -0,0 +1,8 @@
+"""Stand-in for the Raspberry Pi Pico ``board`` module"""
+
+from microcontroller import Pin
+
+for _number in range(30):
+    globals()[f"GP{_number}"] = Pin(f"GP{_number}", _number)
+
+LED = GP25  # noqa: F821
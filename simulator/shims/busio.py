@@ -0,0 +1,75 @@
+"""Stand-in for ``busio``, I2C transfers are charged to the simulated bus"""
+
+from simulator.hardware import HARDWARE
+
+
+class I2C:
+    def __init__(self, scl, sda, *, frequency=100000, timeout=255):
+        self.scl = scl
+        self.sda = sda
+        self.frequency = frequency
+        self._locked = False
+
+    def try_lock(self) -> bool:
+        if self._locked:
+            return False
+        self._locked = True
+        return True
+
+    def unlock(self):
+        self._locked = False
+
+    def scan(self) -> list:
+        return sorted(HARDWARE.expanders)
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        HARDWARE.i2c_transfer(address, end - start, self.frequency)
+        value = HARDWARE.expanders[address].read()
+        for i in range(start, end):
+            buffer[i] = value
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        HARDWARE.i2c_transfer(address, end - start, self.frequency)
+        if end > start:
+            HARDWARE.expanders[address].write(buffer[end - 1])
+
+    def writeto_then_readfrom(
+        self, address, buffer_out, buffer_in, *, out_start=0, out_end=None, in_start=0, in_end=None
+    ):
+        out_end = len(buffer_out) if out_end is None else out_end
+        in_end = len(buffer_in) if in_end is None else in_end
+        # One transaction with repeated start
+        HARDWARE.i2c_transfer(address, out_end - out_start + in_end - in_start, self.frequency)
+        expander = HARDWARE.expanders[address]
+        if out_end > out_start:
+            expander.write(buffer_out[out_end - 1])
+        value = expander.read()
+        for i in range(in_start, in_end):
+            buffer_in[i] = value
+
+    def deinit(self):
+        pass
+
+
+class SPI:
+    def __init__(self, clock, MOSI=None, MISO=None):
+        self.clock = clock
+        self.baudrate = 250000
+        self._locked = False
+
+    def try_lock(self) -> bool:
+        if self._locked:
+            return False
+        self._locked = True
+        return True
+
+    def unlock(self):
+        self._locked = False
+
+    def configure(self, *, baudrate=100000, polarity=0, phase=0, bits=8):
+        self.baudrate = baudrate
+
+    def deinit(self):
+        pass
@@ -0,0 +1,54 @@
+"""Stand-in for ``digitalio``, pin levels live in the simulated hardware"""
+
+from simulator.hardware import HARDWARE
+
+
+class Direction:
+    INPUT = "INPUT"
+    OUTPUT = "OUTPUT"
+
+
+class Pull:
+    UP = "UP"
+    DOWN = "DOWN"
+
+
+class DriveMode:
+    PUSH_PULL = "PUSH_PULL"
+    OPEN_DRAIN = "OPEN_DRAIN"
+
+
+class DigitalInOut:
+    def __init__(self, pin):
+        self.pin = pin
+        self.direction = Direction.INPUT
+        self.pull = None
+        self._value = False
+        HARDWARE.gpio[pin.name] = self
+
+    def switch_to_output(self, value=False, drive_mode=DriveMode.PUSH_PULL):
+        self.direction = Direction.OUTPUT
+        self._value = value
+
+    def switch_to_input(self, pull=None):
+        self.direction = Direction.INPUT
+        self.pull = pull
+
+    def driving_low(self) -> bool:
+        return self.direction == Direction.OUTPUT and not self._value
+
+    @property
+    def value(self) -> bool:
+        if self.direction == Direction.OUTPUT:
+            return self._value
+        source = HARDWARE.gpio_inputs.get(self.pin.name)
+        if source is not None:
+            return source()
+        return self.pull == Pull.UP
+
+    @value.setter
+    def value(self, value: bool):
+        self._value = bool(value)
+
+    def deinit(self):
+        HARDWARE.gpio.pop(self.pin.name, None)
@@ -0,0 +1,6 @@
+"""Stand-in for ``fourwire``"""
+
+
+class FourWire:
+    def __init__(self, spi_bus, *, command, chip_select, reset=None, baudrate=24000000):
+        self.spi_bus = spi_bus
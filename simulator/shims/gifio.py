@@ -0,0 +1,64 @@
+"""Stand-in for ``gifio``. The GIF block structure is walked to get the real
+size, frame count and delays, pixels are not decoded but every frame still
+cost the configured decode time."""
+
+import struct
+
+import displayio
+from simulator.hardware import HARDWARE, spend
+
+
+def _skip_sub_blocks(data, offset):
+    while data[offset]:
+        offset += data[offset] + 1
+    return offset + 1
+
+
+def read_gif_delays(data: bytes):
+    """Return (width, height, [delay of each frame in seconds])"""
+    if data[:3] != b"GIF":
+        raise ValueError("Not a GIF file")
+    width, height, flags = struct.unpack_from("<HHB", data, 6)
+    offset = 13
+    if flags & 0x80:
+        offset += 3 << ((flags & 7) + 1)
+
+    delays = []
+    delay = 0.1
+    while offset < len(data) and data[offset] != 0x3B:
+        block = data[offset]
+        if block == 0x21:  # extension
+            if data[offset + 1] == 0xF9:  # graphic control extension
+                delay = struct.unpack_from("<H", data, offset + 4)[0] / 100
+            offset = _skip_sub_blocks(data, offset + 2)
+        elif block == 0x2C:  # image descriptor
+            image_flags = data[offset + 9]
+            offset += 10
+            if image_flags & 0x80:
+                offset += 3 << ((image_flags & 7) + 1)
+            offset = _skip_sub_blocks(data, offset + 1)
+            delays.append(delay)
+        else:
+            raise ValueError("Invalid GIF block")
+    return width, height, delays
+
+
+class OnDiskGif:
+    def __init__(self, file):
+        with open(file, "rb") as f:
+            self.width, self.height, self._delays = read_gif_delays(f.read())
+        self.frame_count = len(self._delays)
+        self.bitmap = displayio.Bitmap(self.width, self.height, 65535)
+        self.duration = sum(self._delays)
+        self.min_delay = min(self._delays, default=0)
+        self.max_delay = max(self._delays, default=0)
+        self._index = 0
+
+    def next_frame(self) -> float:
+        spend(HARDWARE.gif_frame_cost)
+        delay = self._delays[self._index]
+        self._index = (self._index + 1) % self.frame_count
+        return delay
+
+    def deinit(self):
+        pass
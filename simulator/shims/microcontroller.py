@@ -0,0 +1,13 @@
+"""Stand-in for the CircuitPython ``microcontroller`` module"""
+
+
+class Pin:
+    def __init__(self, name: str, number: int):
+        self.name = name
+        self.number = number
+
+    def __repr__(self):
+        return f"board.{self.name}"
+
+
+nvm = bytearray(b"\xff" * 4096)
@@ -0,0 +1,9 @@
+"""Stand-in for ``rotaryio``, the firmware use the PIO encoder instead"""
+
+
+class IncrementalEncoder:
+    def __init__(self, pin_a, pin_b, divisor=4):
+        self.position = 0
+
+    def deinit(self):
+        pass
@@ -0,0 +1,38 @@
+"""Stand-in for ``rp2pio``, a state machine is only simulated as the
+DualIncrementalEncoder program: it push the 4 pin state on every change."""
+
+from simulator.hardware import HARDWARE
+
+
+def pins_are_sequential(pins) -> bool:
+    return all(b.number == a.number + 1 for a, b in zip(pins, pins[1:]))
+
+
+class StateMachine:
+    def __init__(self, program, frequency, *, first_in_pin=None, **kwargs):
+        self.frequency = frequency
+        self._encoders = HARDWARE.encoder_pair(first_in_pin.number)
+
+    @property
+    def in_waiting(self) -> int:
+        self._encoders.advance()
+        return len(self._encoders.fifo)
+
+    @property
+    def rxstall(self) -> bool:
+        return self._encoders.rxstall
+
+    def clear_rxfifo(self):
+        self._encoders.fifo.clear()
+        self._encoders.rxstall = False
+
+    def readinto(self, buffer, *, start=0, end=None, swap=False):
+        end = len(buffer) if end is None else end
+        for i in range(start, end):
+            # Like on the Pico this block until the FIFO has data
+            while not self._encoders.fifo:
+                self._encoders.advance()
+            buffer[i] = self._encoders.pop()
+
+    def deinit(self):
+        pass
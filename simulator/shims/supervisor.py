@@ -0,0 +1,8 @@
+"""Stand-in for the CircuitPython ``supervisor`` module"""
+
+import time
+
+
+def ticks_ms() -> int:
+    """Milliseconds that wrap around at 2**29, like on the Pico"""
+    return int(time.monotonic() * 1000) & 0x1FFFFFFF
@@ -0,0 +1,39 @@
+"""Stand-in for ``usb_cdc``, writes are recorded by the simulated hardware and
+data sent with HARDWARE.host_send can be read"""
+
+from simulator.hardware import HARDWARE
+
+
+class Serial:
+    def __init__(self, name):
+        self.name = name
+        self.connected = True
+        self.timeout = 1
+        self.write_timeout = None
+
+    def write(self, buf) -> int:
+        HARDWARE.serial_write(self.name, buf)
+        return len(buf)
+
+    @property
+    def in_waiting(self) -> int:
+        return len(HARDWARE.serial_waiting(self.name))
+
+    def read(self, size=1) -> bytes:
+        return HARDWARE.serial_read(self.name, size)
+
+    def readinto(self, buf) -> int:
+        data = HARDWARE.serial_read(self.name, len(buf))
+        buf[: len(data)] = data
+        return len(data)
+
+    def reset_input_buffer(self):
+        HARDWARE.serial_waiting(self.name).clear()
+
+
+console = Serial("console")
+data = Serial("data")
+
+
+def enable(*, console=True, data=False):
+    pass
@@ -0,0 +1,45 @@
+"""Stand-in for ``usb_hid``, every report is recorded by the simulated hardware"""
+
+from simulator.hardware import HARDWARE
+
+
+class Device:
+    def __init__(
+        self,
+        *,
+        report_descriptor=b"",
+        usage_page,
+        usage,
+        report_ids=(0,),
+        in_report_lengths=(0,),
+        out_report_lengths=(0,),
+        name=None,
+    ):
+        self.name = name or {0x06: "keyboard", 0x02: "mouse"}.get(usage, "consumer_control")
+        self.usage_page = usage_page
+        self.usage = usage
+        self.report_ids = tuple(report_ids)
+        self.in_report_lengths = tuple(in_report_lengths)
+        self._last_received = None
+
+    def send_report(self, report, report_id=None):
+        index = 0 if report_id is None else self.report_ids.index(report_id)
+        if len(report) != self.in_report_lengths[index]:
+            raise ValueError("Buffer does not match report length")  # same as CircuitPython
+        HARDWARE.hid_report(self.name, report)
+
+    def get_last_received_report(self, report_id=None):
+        return self._last_received
+
+
+Device.KEYBOARD = Device(usage_page=0x01, usage=0x06, report_ids=(1,), in_report_lengths=(8,))
+Device.MOUSE = Device(usage_page=0x01, usage=0x02, report_ids=(2,), in_report_lengths=(4,))
+Device.CONSUMER_CONTROL = Device(
+    usage_page=0x0C, usage=0x01, report_ids=(3,), in_report_lengths=(2,)
+)
+
+devices = [Device.KEYBOARD, Device.MOUSE, Device.CONSUMER_CONTROL]
+
+
+def enable(devices_to_enable, boot_device=0):
+    devices[:] = list(devices_to_enable)